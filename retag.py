@@ -0,0 +1,11 @@
+"""
+DeeFix - Re-tag genre/mood from stored Essentia activations.
+Applies the current thresholds to every analyzed track without decoding audio.
+
+Usage: python retag.py [--genre-threshold 0.15] [--mood-threshold 0.005] [--dry-run]
+"""
+
+from src.retag import main
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,13 @@
+"""
+DeeFix - Track similarity over stored Essentia embeddings.
+
+Usage:
+    python similar.py build [--clusters N]
+    python similar.py query /music/Artist/Album/Title.mp3 [-k 10] [--probes 8]
+    python similar.py serve [--host 127.0.0.1] [--port 8765]
+"""
+
+from src.similarity import main
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Album-level Deezer matching.
+Resolves the Deezer album of each (folder, album artist, album) once, keeps its
+track list in memory and matches every file of that album against it: by ISRC
+first, then by disc/track number and duration, then by title and duration.
+"""
+
+import os
+import re
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+# Albums whose Deezer track list stays in memory
+ALBUM_CACHE_SIZE = 32
+# Maximum duration difference in seconds for number or title matches
+DURATION_TOLERANCE = 3
+
+_albums = OrderedDict()
+_albums_lock = threading.Lock()
+
+
+def _tag(tags, key):
+    value = tags.get(key, [''])
+    if isinstance(value, list):
+        value = value[0] if value else ''
+    return (value or '').strip()
+
+
+def _first_number(value):
+    """Parse '3' or '3/12' into 3, None if there is no number."""
+    match = re.match(r'\s*(\d+)', value or '')
+    return int(match.group(1)) if match else None
+
+
+def _normalize(text):
+    return re.sub(r'\W+', '', (text or '').casefold())
+
+
+def _resolve_album(tags, artist, album):
+    """Find the Deezer album of a file and fetch its info and track list.
+
+    Returns:
+        Dictionary {'info', 'tracks'}, or None if the album tag is empty or
+        the album was not found
+    """
+    from .deezer_api import (
+        get_deezer_track_by_isrc, search_deezer_album, get_deezer_album_info, get_deezer_album_tracks,
+    )
+    wanted = _normalize(album)
+    if not wanted:
+        # Every album title starts with an empty one: nothing to match against
+        return None
+    album_id = None
+    isrc = _tag(tags, 'isrc')
+    if isrc:
+        track = get_deezer_track_by_isrc(isrc)
+        if track and track.get('album'):
+            album_id = track['album'].get('id')
+    if album_id is None:
+        results = search_deezer_album(_tag(tags, 'albumartist') or artist, album)
+        exact = [r for r in results if _normalize(r.get('title')) == wanted]
+        # Accept "Album (Deluxe Edition)" and the like when there is no exact title
+        prefixed = [r for r in results if _normalize(r.get('title')).startswith(wanted)]
+        candidates = exact or prefixed
+        if candidates:
+            album_id = candidates[0]['id']
+    if album_id is None:
+        print(f"Album not found on Deezer: {album}", file=sys.stderr)
+        return None
+    info = get_deezer_album_info(album_id)
+    tracks = get_deezer_album_tracks(album_id)
+    if not info or not tracks:
+        return None
+    print(f"Deezer album resolved: {info.get('title')} ({len(tracks)} tracks)", file=sys.stderr)
+    return {'info': info, 'tracks': tracks}
+
+
+def _match_track(tracks, tags, title, duration):
+    """Pick the album track that corresponds to a local file."""
+    isrc = _tag(tags, 'isrc').upper()
+    if isrc:
+        for track in tracks:
+            if (track.get('isrc') or '').upper() == isrc:
+                return track
+
+    def duration_matches(track):
+        return duration is None or abs(track.get('duration', 0) - duration) <= DURATION_TOLERANCE
+
+    track_number = _first_number(_tag(tags, 'tracknumber'))
+    disc_number = _first_number(_tag(tags, 'discnumber')) or 1
+    if track_number:
+        for track in tracks:
+            if (track.get('track_position') == track_number and track.get('disk_number', 1) == disc_number
+                    and duration_matches(track)):
+                return track
+
+    wanted = _normalize(title)
+    for track in tracks:
+        if _normalize(track.get('title')) == wanted and duration_matches(track):
+            return track
+    return None
+
+
+def _album_track_info(track, album_info):
+    """Shape an album track like a /track/{id} payload for tag writing."""
+    info = dict(track)
+    info['album'] = {
+        'id': album_info.get('id'),
+        'title': album_info.get('title'),
+        'artist': album_info.get('artist'),
+    }
+    info['release_date'] = album_info.get('release_date')
+    # Album listings only carry the main artist: leave contributors out so the
+    # file keeps its own artist tag rather than losing featured artists
+    info.pop('contributors', None)
+    return info
+
+
+def _get_album(key, tags, artist, album):
+    """Return the resolved album of a key, resolving it on first use.
+
+    Concurrent callers for the same key wait for the lookup already in flight;
+    lookups of other albums are not blocked by it.
+    """
+    with _albums_lock:
+        future = _albums.get(key)
+        owner = future is None
+        if owner:
+            future = _albums[key] = Future()
+            if len(_albums) > ALBUM_CACHE_SIZE:
+                _albums.popitem(last=False)
+        else:
+            _albums.move_to_end(key)
+    if not owner:
+        return future.result()
+    try:
+        context = _resolve_album(tags, artist, album)
+    except BaseException as e:
+        # Not cached: the next file of the album tries again
+        with _albums_lock:
+            if _albums.get(key) is future:
+                del _albums[key]
+        future.set_exception(e)
+        raise
+    future.set_result(context)
+    return context
+
+
+def find_album_track(file_path, tags, artist, album, title, duration=None):
+    """Match a file against the Deezer album it is tagged with.
+
+    The album is resolved once per folder and album tags (a folder of singles
+    or mixed albums holds several) and its track list reused for every file
+    of it.
+
+    Args:
+        file_path: Path to the MP3 file
+        tags: Current MP3 tags
+        artist: Artist name
+        album: Album name
+        title: Track title
+        duration: Audio duration in seconds (None skips duration checks)
+
+    Returns:
+        Deezer track info dictionary, or None if no album track matches
+    """
+    key = (os.path.dirname(file_path), _normalize(_tag(tags, 'albumartist') or artist), _normalize(album))
+    context = _get_album(key, tags, artist, album)
+    if not context:
+        return None
+    track = _match_track(context['tracks'], tags, title, duration)
+    if track is None:
+        print("No matching track in the file's Deezer album", file=sys.stderr)
+        return None
+    return _album_track_info(track, context['info'])
@@ -6,18 +6,272 @@ Fetches and generates cover.webp artwork from Apple Music album video.
 import os
 import re
 import sys
+import time
+import threading
+import tempfile
 import subprocess
-import requests
+from urllib.parse import urljoin
+from concurrent.futures import Future, ThreadPoolExecutor
 from ddgs import DDGS
+from . import http_client
+from .config import get_processing_options
+from .database import get_artwork_album, save_artwork_album, get_artwork_video, save_artwork_video
 
+# Age in seconds after which "no result" / "no video" entries are checked again
+NEGATIVE_RECHECK_SECONDS = 30 * 24 * 3600
 
-def fetch_video_artwork(artist, album, title, file_path, stats=None):
+# Side of the square artwork in pixels
+ARTWORK_SIZE = 720
+FFMPEG_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
+
+# Album lookups in progress, keyed by album key
+_inflight = {}
+_inflight_lock = threading.Lock()
+_encode_executor = None
+_encode_executor_lock = threading.Lock()
+# Encodes queued or running, keyed by output path
+_encodes = {}
+_encodes_lock = threading.Lock()
+
+
+def _album_key(albumartist, album):
+    return '|'.join(' '.join((value or '').casefold().split()) for value in (albumartist, album))
+
+
+def _search_apple_album_url(artist, album, title):
+    """Search DuckDuckGo for the Apple Music album page, None if not found."""
+    os.environ['CURL_CFFI_IMPERSONATE'] = 'random'
+    query = f"{artist} {album} {title} site:music.apple.com"
+    results = []
+    with http_client.host_guard('duckduckgo.com'), DDGS() as ddgs:
+        for r in ddgs.text(query, region='wt-wt', safesearch='Off', max_results=10):
+            url = r.get('href') or r.get('url')
+            if url:
+                results.append(url)
+
+    # Filter for album links only
+    album_links = [u for u in results if "/album/" in u]
+    if not album_links:
+        print("No Apple Music album URL found in search results.", file=sys.stderr)
+        print(f"Search results: {results}", file=sys.stderr)
+        return None
+    return album_links[0]
+
+
+def _scrape_m3u8_url(apple_url):
+    """Fetch an Apple Music album page and extract its video stream URL.
+
+    Returns:
+        Tuple (definitive, m3u8 URL or None); definitive is False when the
+        page could not be fetched
+    """
+    headers = {"User-Agent": "Mozilla/5.0"}
+    page = http_client.get(apple_url, headers=headers)
+    if page.status_code != 200:
+        print(f"Apple Music error: {page.status_code}", file=sys.stderr)
+        return False, None
+
+    for match in re.finditer(r'<amp-ambient-video[^>]*src=\"([^\"]+\.m3u8)\"', page.text):
+        candidate = match.group(1)
+        if candidate.startswith("https://"):
+            return True, candidate
+    print("No m3u8 found on the album page from Apple Music.", file=sys.stderr)
+    return True, None
+
+
+def _lookup_album_video(album_key, artist, album, title):
+    """Resolve an album to its video stream, using the database cache first."""
+    now = time.time()
+    cached = get_artwork_album(album_key)
+    # Albums without results are searched again once the entry is stale
+    if cached and (cached[0] or now - cached[1] < NEGATIVE_RECHECK_SECONDS):
+        apple_url = cached[0]
+    else:
+        apple_url = _search_apple_album_url(artist, album, title)
+        save_artwork_album(album_key, apple_url, now)
+    if not apple_url:
+        return None
+
+    cached = get_artwork_video(apple_url)
+    if cached and (cached[0] or now - cached[1] < NEGATIVE_RECHECK_SECONDS):
+        if not cached[0]:
+            print(f"Apple Music album has no video (cached): {apple_url}", file=sys.stderr)
+        return cached[0]
+    definitive, m3u8_url = _scrape_m3u8_url(apple_url)
+    if definitive:
+        save_artwork_video(apple_url, m3u8_url, now)
+    return m3u8_url
+
+
+def resolve_album_video(albumartist, album, artist, title):
+    """Return the Apple Music video stream of an album, looked up once per album.
+
+    Concurrent callers for the same (albumartist, album) wait for the lookup
+    already in flight instead of starting their own.
+
+    Args:
+        albumartist: Album artist name
+        album: Album name
+        artist: Track artist name (used in the search query)
+        title: Track title (used in the search query)
+
+    Returns:
+        m3u8 URL, or None if the album has no video
+
+    Raises:
+        HostUnavailableError: If DuckDuckGo or Apple Music is unavailable
+    """
+    album_key = _album_key(albumartist, album)
+    with _inflight_lock:
+        future = _inflight.get(album_key)
+        owner = future is None
+        if owner:
+            future = _inflight[album_key] = Future()
+    if not owner:
+        print(f"Waiting for artwork lookup in progress for {album}", file=sys.stderr)
+        return future.result()
+    try:
+        m3u8_url = _lookup_album_video(album_key, artist, album, title)
+        future.set_result(m3u8_url)
+        return m3u8_url
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(album_key, None)
+
+
+def _get_encode_executor():
+    """Return the artwork encoding pool, sized by ARTWORK_ENCODE_WORKERS."""
+    global _encode_executor
+    with _encode_executor_lock:
+        if _encode_executor is None:
+            workers = max(1, get_processing_options()['artwork_encode_workers'])
+            _encode_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='artwork')
+        return _encode_executor
+
+
+def select_hls_variant(m3u8_url, size=ARTWORK_SIZE):
+    """Pick the smallest HLS variant at least `size` pixels on its short side.
+
+    Falls back to the largest variant, or to the given URL when it is not a
+    master playlist or cannot be fetched.
+
+    Args:
+        m3u8_url: HLS master playlist URL
+        size: Target square size in pixels
+
+    Returns:
+        URL of the variant playlist to decode
+    """
+    try:
+        response = http_client.get(m3u8_url, headers={"User-Agent": FFMPEG_USER_AGENT})
+    except http_client.HostUnavailableError:
+        return m3u8_url
+    if response.status_code != 200:
+        return m3u8_url
+    variants = []
+    lines = response.text.splitlines()
+    for line, next_line in zip(lines, lines[1:]):
+        if not line.startswith('#EXT-X-STREAM-INF'):
+            continue
+        match = re.search(r'RESOLUTION=(\d+)x(\d+)', line)
+        if match and next_line and not next_line.startswith('#'):
+            variants.append((min(int(match.group(1)), int(match.group(2))), urljoin(m3u8_url, next_line.strip())))
+    if not variants:
+        return m3u8_url
+    large_enough = [variant for variant in variants if variant[0] >= size]
+    side, url = min(large_enough) if large_enough else max(variants)
+    print(f"Using {side}p HLS variant out of {len(variants)}", file=sys.stderr)
+    return url
+
+
+def encode_artwork(m3u8_url, out_path):
+    """Encode the start of an album video into an animated square WebP.
+
+    Clip length, frame rate, ffmpeg threads (decoding, filtering and
+    encoding) and run time are capped by the ARTWORK_* options. The image is
+    written to a unique temporary file next to out_path and renamed once
+    complete, so a failed or timed-out encode leaves nothing behind.
+
+    Args:
+        m3u8_url: HLS master playlist URL
+        out_path: Path of the cover.webp to write
+
+    Returns:
+        True if the artwork was written, False otherwise
+    """
+    options = get_processing_options()
+    threads = str(options['artwork_ffmpeg_threads'])
+    fd, tmp_path = tempfile.mkstemp(prefix=".cover.", suffix=".tmp.webp", dir=os.path.dirname(out_path))
+    os.close(fd)
+    ffmpeg_cmd = [
+        "ffmpeg", "-y", "-nostdin",
+        "-filter_threads", threads,
+        "-user_agent", FFMPEG_USER_AGENT,
+        "-threads", threads,
+        "-t", str(options['artwork_max_seconds']),
+        "-i", select_hls_variant(m3u8_url),
+        "-vf", f"fps={options['artwork_fps']},scale={ARTWORK_SIZE}:{ARTWORK_SIZE}:flags=lanczos",
+        "-threads", threads,
+        "-loop", "0",
+        tmp_path
+    ]
+    start = time.monotonic()
+    try:
+        subprocess.run(ffmpeg_cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                       timeout=options['artwork_encode_timeout'])
+        # mkstemp creates the file private to its owner
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, out_path)
+    except Exception as ffmpeg_error:
+        if os.path.exists(tmp_path):
+            try:
+                os.remove(tmp_path)
+            except Exception as rm_error:
+                print(f"Error deleting partial artwork: {rm_error}", file=sys.stderr)
+        print(f"Error fetch_video_artwork: {ffmpeg_error}", file=sys.stderr)
+        return False
+    print(f"Artwork generated successfully: {out_path} "
+          f"({os.path.getsize(out_path) / 1024:.0f} KB in {time.monotonic() - start:.1f}s)", file=sys.stderr)
+    return True
+
+
+def _encode_missing_artwork(m3u8_url, out_path):
+    """Encode job: None if out_path was written while the job was queued."""
+    if os.path.exists(out_path):
+        return None
+    return encode_artwork(m3u8_url, out_path)
+
+
+def _submit_encode(m3u8_url, out_path):
+    """Queue an artwork encode, joining the one already queued for out_path.
+
+    Returns:
+        Tuple of (Future of the encode result, True if this call queued it)
+    """
+    with _encodes_lock:
+        future = _encodes.get(out_path)
+        if future is not None:
+            return future, False
+        future = _encodes[out_path] = _get_encode_executor().submit(_encode_missing_artwork, m3u8_url, out_path)
+
+    def _done(_):
+        with _encodes_lock:
+            _encodes.pop(out_path, None)
+
+    future.add_done_callback(_done)
+    return future, True
+
+
+def fetch_video_artwork(artist, album, title, file_path, stats=None, albumartist=None):
     """Fetch and generate cover.webp artwork from Apple Music album video.
     
     Process:
-    1. Search DuckDuckGo for Apple Music album page
-    2. Extract m3u8 video URL from the page
-    3. Use ffmpeg to generate a 720x720 webp image
+    1. Search DuckDuckGo for Apple Music album page (once per album)
+    2. Extract m3u8 video URL from the page (cached, including "no video")
+    3. Use ffmpeg to generate a 720x720 webp image on the bounded encoding pool
     
     Args:
         artist: Artist name
@@ -25,9 +279,13 @@ def fetch_video_artwork(artist, album, title, file_path, stats=None):
         title: Track title
         file_path: Path to the MP3 file (artwork saved in same directory)
         stats: Statistics dictionary (optional)
+        albumartist: Album artist name (defaults to artist)
         
     Returns:
         True if artwork was generated or already exists, False otherwise
+        
+    Raises:
+        HostUnavailableError: If DuckDuckGo or Apple Music is unavailable
     """
     out_dir = os.path.dirname(file_path)
     out_path = os.path.join(out_dir, "cover.webp")
@@ -38,73 +296,28 @@ def fetch_video_artwork(artist, album, title, file_path, stats=None):
         return True  # Already exists, consider as success
     
     try:
-        os.environ['CURL_CFFI_IMPERSONATE'] = 'random'
-
-        # Step 1: Search for Apple Music album page
-        query = f"{artist} {album} {title} site:music.apple.com"
-        results = []
-        with DDGS() as ddgs:
-            for r in ddgs.text(query, region='wt-wt', safesearch='Off', max_results=10):
-                url = r.get('href') or r.get('url')
-                if url:
-                    results.append(url)
-
-        # Filter for album links only
-        album_links = [u for u in results if "/album/" in u]
-        if not album_links:
-            print("No Apple Music album URL found in search results.", file=sys.stderr)
-            print(f"Search results: {results}", file=sys.stderr)
-            return False
-
-        apple_url = album_links[0]
-
-        # Step 2: Fetch Apple Music page
-        headers = {"User-Agent": "Mozilla/5.0"}
-        page = requests.get(apple_url, headers=headers, timeout=10)
-        if page.status_code != 200:
-            print(f"Apple Music error: {page.status_code}", file=sys.stderr)
-            return False
-
-        # Step 3: Extract m3u8 video URL
-        m3u8_url = None
-        for match in re.finditer(r'<amp-ambient-video[^>]*src=\"([^\"]+\.m3u8)\"', page.text):
-            candidate = match.group(1)
-            if candidate.startswith("https://"):
-                m3u8_url = candidate
-                break
-
+        m3u8_url = resolve_album_video(albumartist or artist, album, artist, title)
         if not m3u8_url:
-            print("No m3u8 found on the album page from Apple Music.", file=sys.stderr)
             return False
+        # Another track of the album may have generated it meanwhile
+        if os.path.exists(out_path):
+            return True
 
-        # Step 4: Generate cover.webp with ffmpeg
-        ffmpeg_cmd = [
-            "ffmpeg",
-            "-user_agent", "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
-            "-i", m3u8_url,
-            "-vf", "scale=720:720:flags=lanczos",
-            "-loop", "0",
-            out_path
-        ]
-
-        try:
-            subprocess.run(ffmpeg_cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        except Exception as ffmpeg_error:
-            # Si ffmpeg a échoué, supprimer cover.webp si vide
-            if os.path.exists(out_path) and os.path.getsize(out_path) == 0:
-                try:
-                    os.remove(out_path)
-                    print(f"cover.webp was empty after ffmpeg failure, deleted: {out_path}", file=sys.stderr)
-                except Exception as rm_error:
-                    print(f"Error deleting empty cover.webp: {rm_error}", file=sys.stderr)
-            print(f"Error fetch_video_artwork: {ffmpeg_error}", file=sys.stderr)
+        # Encode cover.webp on the bounded artwork pool, once per output path
+        future, owner = _submit_encode(m3u8_url, out_path)
+        result = future.result()
+        if result is None:
+            return True
+        if not result:
             return False
 
-        print(f"Artwork generated successfully: {out_path}", file=sys.stderr)
-        if stats is not None:
+        if stats is not None and owner:
             stats['artwork_fetched'] += 1
         return True  # Success
 
+    except http_client.HostUnavailableError:
+        # Let the caller defer the file until the service is back
+        raise
     except Exception as e:
         print(f"Error fetch_video_artwork: {e}", file=sys.stderr)
         return False
@@ -5,7 +5,6 @@ Uses a debounce timer to coalesce rapid calls into a single HTTP request.
 
 import sys
 import threading
-import requests
 from .config import get_processing_options
 
 _rescan_timer = None
@@ -36,13 +35,13 @@ def schedule_global_rescan():
 
 
 def _trigger_global_rescan():
+    from . import http_client
     options = get_processing_options()
     url = options['audiomuse_url'] + '/api/analysis/start'
     try:
-        response = requests.post(
+        response = http_client.post(
             url,
             json={"num_recent_albums": 10, "top_n_moods": 15},
-            timeout=30,
         )
         response.raise_for_status()
         print(f"Audiomuse-AI rescan triggered: {url} -> HTTP {response.status_code}", file=sys.stderr)
@@ -8,6 +8,12 @@ import os
 # Database path
 DB_PATH = os.path.join('/data', 'mp3_processed.db')
 
+# Cache of API responses, next to the processing database
+CACHE_DB_PATH = os.path.join('/data', 'response_cache.db')
+
+# Similarity index over stored track embeddings
+SIMILARITY_DIR = os.path.join('/data', 'similarity')
+
 
 def get_processing_options():
     """Return a dict of all relevant processing options from environment variables.
@@ -18,20 +24,72 @@ def get_processing_options():
         - fetch_lyrics: Whether to fetch synchronized lyrics
         - remove_duplicates: Whether to remove duplicate files
         - fetch_video_artwork: Whether to generate artwork from Apple Music
+        - artwork_encode_workers: Artwork ffmpeg encodes running at the same time
+        - artwork_encode_timeout: Seconds after which an artwork encode is killed
+        - artwork_max_seconds: Seconds of album video turned into artwork
+        - artwork_fps: Frame rate of the animated artwork
+        - artwork_ffmpeg_threads: Threads given to each artwork ffmpeg encode
         - fix_gain: Whether to apply loudgain normalization
         - analyze_essentia: Whether to analyze tracks with Essentia extractor
+        - essentia_mode: 'full' analyzes whole tracks, 'sampled' only a few evenly spaced segments
+        - essentia_sample_segments: Number of segments decoded in sampled mode
+        - essentia_sample_seconds: Length in seconds of each sampled segment
+        - essentia_batch_size: Mel patches per cross-file Essentia batch (0 disables batching)
+        - essentia_batch_max_wait: Maximum seconds a file waits for its Essentia batch
+        - essentia_stream_min_duration: Track length (seconds) from which Essentia streams the audio (0 disables)
+        - essentia_workers: Essentia worker processes ('auto' scales with cores, 0 runs inline)
+        - essentia_worker_threads: TensorFlow intra-op threads per Essentia worker
+        - id3_padding: Bytes of padding reserved when a tag write has to grow the ID3 tag
         - fix_mp3_permission: Whether to set owner to 1000:1000 on organized files/folders
+        - http_connect_timeout: Seconds to wait for an HTTP connection
+        - http_read_timeout: Seconds to wait for HTTP response data
+        - http_retries: Retries with backoff for failed idempotent HTTP requests
+        - lrclib_db_path: Path to a local lrclib SQLite dump queried before lrclib.net (empty disables it)
+        - deezer_album_mode: Whether to resolve each folder/album tag's Deezer album once and match its files locally
+        - deezer_cache_ttl: Seconds Deezer search/track responses stay cached (0 disables the cache)
+        - deezer_cache_negative_ttl: Seconds empty Deezer results stay cached
+        - lyrics_cache_ttl: Seconds found lyrics stay cached (0 disables the lyrics cache)
+        - lyrics_cache_negative_ttl: Seconds "no lyrics" answers stay cached
+        - response_cache_max_entries: Cached Deezer/lyrics responses kept before LRU eviction (0 disables the cap)
+        - db_commit_batch: Database writes committed together
+        - db_commit_interval: Maximum seconds a write waits for its group commit
     """
     return {
         'fix_tags': os.environ.get('FIX_TAGS', 'true').lower() == 'true',
         'fetch_lyrics': os.environ.get('FETCH_LYRICS', 'false').lower() == 'true',
         'remove_duplicates': os.environ.get('REMOVE_DUPLICATES', 'false').lower() == 'true',
         'fetch_video_artwork': os.environ.get('FETCH_VIDEO_ARTWORK', 'true').lower() == 'true',
+        'artwork_encode_workers': int(os.environ.get('ARTWORK_ENCODE_WORKERS', '1')),
+        'artwork_encode_timeout': int(os.environ.get('ARTWORK_ENCODE_TIMEOUT', '120')),
+        'artwork_max_seconds': float(os.environ.get('ARTWORK_MAX_SECONDS', '15')),
+        'artwork_fps': int(os.environ.get('ARTWORK_FPS', '15')),
+        'artwork_ffmpeg_threads': int(os.environ.get('ARTWORK_FFMPEG_THREADS', '2')),
         'fix_gain': os.environ.get('FIX_GAIN', 'false').lower() == 'true',
         'analyze_essentia': os.environ.get('ANALYZE_ESSENTIA', 'false').lower() == 'true',
+        'essentia_mode': os.environ.get('ESSENTIA_MODE', 'full').lower(),
+        'essentia_sample_segments': int(os.environ.get('ESSENTIA_SAMPLE_SEGMENTS', '3')),
+        'essentia_sample_seconds': float(os.environ.get('ESSENTIA_SAMPLE_SECONDS', '10')),
+        'essentia_batch_size': int(os.environ.get('ESSENTIA_BATCH_SIZE', '0')),
+        'essentia_batch_max_wait': float(os.environ.get('ESSENTIA_BATCH_MAX_WAIT', '5')),
+        'essentia_stream_min_duration': int(os.environ.get('ESSENTIA_STREAM_MIN_DURATION', '1200')),
+        'essentia_workers': os.environ.get('ESSENTIA_WORKERS', '0'),
+        'essentia_worker_threads': int(os.environ.get('ESSENTIA_WORKER_THREADS', '2')),
         'organize_mp3': os.environ.get('ORGANIZE_MP3', 'false').lower() == 'true',
+        'id3_padding': int(os.environ.get('ID3_PADDING', '16384')),
         'fix_mp3_permission': os.environ.get('FIX_MP3_PERMISSION', 'false').lower() == 'true',
         'call_audiomuse': os.environ.get('AUDIOMUSE_AI_CALL', 'false').lower() == 'true',
         'audiomuse_url': os.environ.get('AUDIOMUSE_AI_URL', '').rstrip('/'),
         'audiomuse_debounce': int(os.environ.get('AUDIOMUSE_AI_DEBOUNCE', '30')),
+        'http_connect_timeout': float(os.environ.get('HTTP_CONNECT_TIMEOUT', '5')),
+        'http_read_timeout': float(os.environ.get('HTTP_READ_TIMEOUT', '30')),
+        'http_retries': int(os.environ.get('HTTP_RETRIES', '2')),
+        'lrclib_db_path': os.environ.get('LRCLIB_DB_PATH', ''),
+        'deezer_album_mode': os.environ.get('DEEZER_ALBUM_MODE', 'false').lower() == 'true',
+        'deezer_cache_ttl': int(os.environ.get('DEEZER_CACHE_TTL', str(30 * 24 * 3600))),
+        'deezer_cache_negative_ttl': int(os.environ.get('DEEZER_CACHE_NEGATIVE_TTL', str(24 * 3600))),
+        'lyrics_cache_ttl': int(os.environ.get('LYRICS_CACHE_TTL', str(180 * 24 * 3600))),
+        'lyrics_cache_negative_ttl': int(os.environ.get('LYRICS_CACHE_NEGATIVE_TTL', str(7 * 24 * 3600))),
+        'response_cache_max_entries': int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', '100000')),
+        'db_commit_batch': int(os.environ.get('DB_COMMIT_BATCH', '100')),
+        'db_commit_interval': float(os.environ.get('DB_COMMIT_INTERVAL', '2')),
     }
@@ -1,10 +1,82 @@
 """
 Database operations for tracking processed MP3 files.
 Uses SQLite to store processing status.
+
+One connection per process is shared by all threads, in WAL mode, so
+statements are prepared once and reused. Every write is committed in groups
+(every DB_COMMIT_BATCH writes or DB_COMMIT_INTERVAL seconds). While a group is
+pending this process holds SQLite's write lock, so writers in other processes
+wait for it (at most DB_COMMIT_INTERVAL): call flush_db() before handing work
+to another process. The Essentia worker processes commit their writes at once.
 """
 
+import atexit
 import sqlite3
-from .config import DB_PATH
+import threading
+from .config import DB_PATH, get_processing_options
+
+_conn = None
+_lock = threading.RLock()
+_pending_writes = 0
+_flush_timer = None
+_commit_batch = 1
+_commit_interval = 0.0
+
+
+def _connect():
+    """Return the process connection, opening it on first use (call with _lock held)."""
+    global _conn, _commit_batch, _commit_interval
+    if _conn is None:
+        options = get_processing_options()
+        _commit_batch = max(1, options['db_commit_batch'])
+        _commit_interval = options['db_commit_interval']
+        conn = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False)
+        # Readers and the Essentia worker processes are not blocked by writes,
+        # and commits only sync the WAL at checkpoints
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        _conn = conn
+        atexit.register(close_db)
+    return _conn
+
+
+def _commit():
+    global _pending_writes, _flush_timer
+    _conn.commit()
+    _pending_writes = 0
+    if _flush_timer is not None:
+        _flush_timer.cancel()
+        _flush_timer = None
+
+
+def _commit_later():
+    """Count a pending write, committing once the batch is full (call with _lock held)."""
+    global _pending_writes, _flush_timer
+    _pending_writes += 1
+    if _pending_writes >= _commit_batch:
+        _commit()
+    elif _flush_timer is None:
+        # An open write transaction blocks other writers, never keep it for long
+        _flush_timer = threading.Timer(_commit_interval, flush_db)
+        _flush_timer.daemon = True
+        _flush_timer.start()
+
+
+def flush_db():
+    """Commit pending writes now, releasing the write lock for other processes."""
+    with _lock:
+        if _conn is not None and _pending_writes:
+            _commit()
+
+
+def close_db():
+    """Commit pending writes and close the connection."""
+    global _conn
+    with _lock:
+        if _conn is not None:
+            _commit()
+            _conn.close()
+            _conn = None
 
 
 def init_db():
@@ -13,8 +85,13 @@ def init_db():
     Creates a table with columns for tracking which processing steps
     have been completed for each file.
     """
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+    with _lock:
+        conn = _connect()
+        _create_tables(conn.cursor())
+        conn.commit()
+
+
+def _create_tables(c):
     c.execute('''CREATE TABLE IF NOT EXISTS processed_files (
         filepath TEXT PRIMARY KEY,
         tags_fixed INTEGER DEFAULT 0,
@@ -22,11 +99,35 @@ def init_db():
         artwork_generated INTEGER DEFAULT 0,
         gain_applied INTEGER DEFAULT 0,
         essentia_analyzed INTEGER DEFAULT 0,
+        essentia_sampled INTEGER DEFAULT 0,
         last_processed TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     )''')
     _ensure_column_exists(c, 'processed_files', 'essentia_analyzed', 'INTEGER DEFAULT 0')
-    conn.commit()
-    conn.close()
+    _ensure_column_exists(c, 'processed_files', 'essentia_sampled', 'INTEGER DEFAULT 0')
+    c.execute('''CREATE TABLE IF NOT EXISTS essentia_activations (
+        audio_hash TEXT PRIMARY KEY,
+        model TEXT,
+        genre_activations BLOB,
+        mood_activations BLOB,
+        embedding BLOB,
+        sampled INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    _ensure_column_exists(c, 'essentia_activations', 'sampled', 'INTEGER DEFAULT 0')
+    c.execute('''CREATE TABLE IF NOT EXISTS essentia_files (
+        filepath TEXT PRIMARY KEY,
+        audio_hash TEXT
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS artwork_albums (
+        album_key TEXT PRIMARY KEY,
+        apple_url TEXT,
+        checked_at REAL
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS artwork_videos (
+        apple_url TEXT PRIMARY KEY,
+        m3u8_url TEXT,
+        checked_at REAL
+    )''')
 
 
 def _ensure_column_exists(cursor, table_name, column_name, column_definition):
@@ -45,28 +146,30 @@ def is_file_processed(file_path):
         
     Returns:
         Dictionary with processing status (tags_fixed, lyrics_fetched,
-        artwork_generated, gain_applied, essentia_analyzed) or None if not processed
+        artwork_generated, gain_applied, essentia_analyzed, essentia_sampled)
+        or None if not processed
     """
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''SELECT tags_fixed, lyrics_fetched, artwork_generated, gain_applied, essentia_analyzed 
-                 FROM processed_files WHERE filepath=?''', (file_path,))
-    result = c.fetchone()
-    conn.close()
+    with _lock:
+        c = _connect().cursor()
+        c.execute('''SELECT tags_fixed, lyrics_fetched, artwork_generated, gain_applied, essentia_analyzed,
+                     essentia_sampled
+                     FROM processed_files WHERE filepath=?''', (file_path,))
+        result = c.fetchone()
     if result:
         return {
             'tags_fixed': bool(result[0]),
             'lyrics_fetched': bool(result[1]),
             'artwork_generated': bool(result[2]),
             'gain_applied': bool(result[3]),
-            'essentia_analyzed': bool(result[4])
+            'essentia_analyzed': bool(result[4]),
+            'essentia_sampled': bool(result[5])
         }
     return None
 
 
 def update_file_processing_status(file_path, tags_fixed=False, lyrics_fetched=False,
                                    artwork_generated=False, gain_applied=False,
-                                   essentia_analyzed=False):
+                                   essentia_analyzed=False, essentia_sampled=False):
     """Update the processing status for a file in the database.
     
     Args:
@@ -75,21 +178,200 @@ def update_file_processing_status(file_path, tags_fixed=False, lyrics_fetched=Fa
         lyrics_fetched: Whether lyrics were fetched
         artwork_generated: Whether artwork was generated
         gain_applied: Whether gain normalization was applied
-                essentia_analyzed: Whether Essentia analysis was applied
+        essentia_analyzed: Whether Essentia analysis was applied
+        essentia_sampled: Whether the Essentia analysis only covered sampled segments
     """
+    with _lock:
+        c = _connect().cursor()
+        c.execute('''INSERT INTO processed_files 
+                                     (filepath, tags_fixed, lyrics_fetched, artwork_generated, gain_applied, essentia_analyzed,
+                                      essentia_sampled)
+                                     VALUES (?, ?, ?, ?, ?, ?, ?)
+                     ON CONFLICT(filepath) DO UPDATE SET
+                     tags_fixed = excluded.tags_fixed,
+                     lyrics_fetched = excluded.lyrics_fetched,
+                     artwork_generated = excluded.artwork_generated,
+                     gain_applied = excluded.gain_applied,
+                                     essentia_analyzed = excluded.essentia_analyzed,
+                     essentia_sampled = excluded.essentia_sampled,
+                     last_processed = CURRENT_TIMESTAMP''',
+                  (file_path, int(tags_fixed), int(lyrics_fetched), 
+                                 int(artwork_generated), int(gain_applied), int(essentia_analyzed),
+                                 int(essentia_sampled)))
+        # A crash loses at most the last batch, whose files are simply
+        # processed again
+        _commit_later()
+
+
+def get_essentia_activations(audio_hash, model, allow_sampled=False):
+    """Fetch cached Essentia activation vectors for an audio hash.
+    
+    Args:
+        audio_hash: Hash of the MPEG audio data
+        model: Identifier of the models that produced the vectors
+        allow_sampled: Whether vectors from a sampled-segments analysis qualify
+        
+    Returns:
+        Tuple of (genre_activations, mood_activations, embedding) float32
+        bytes plus the sampled flag, or None if not cached for this model
+    """
+    with _lock:
+        c = _connect().cursor()
+        c.execute('''SELECT genre_activations, mood_activations, embedding, sampled
+                     FROM essentia_activations WHERE audio_hash=? AND model=? AND sampled<=?''',
+                  (audio_hash, model, int(allow_sampled)))
+        result = c.fetchone()
+    return result
+
+
+def save_essentia_activations(audio_hash, model, genre_activations, mood_activations, embedding,
+                              sampled=False):
+    """Store Essentia activation vectors for an audio hash.
+    
+    Args:
+        audio_hash: Hash of the MPEG audio data
+        model: Identifier of the models that produced the vectors
+        genre_activations: Mean genre activations (float32 bytes)
+        mood_activations: Mean mood activations (float32 bytes)
+        embedding: Mean discogs-effnet embedding (float32 bytes)
+        sampled: Whether the vectors come from a sampled-segments analysis
+    """
+    with _lock:
+        c = _connect().cursor()
+        c.execute('''INSERT OR REPLACE INTO essentia_activations
+                     (audio_hash, model, genre_activations, mood_activations, embedding, sampled)
+                     VALUES (?, ?, ?, ?, ?, ?)''',
+                  (audio_hash, model, genre_activations, mood_activations, embedding, int(sampled)))
+        _commit_later()
+
+
+def save_essentia_file(file_path, audio_hash):
+    """Record which stored activation vectors belong to a file.
+    
+    Args:
+        file_path: Path to the MP3 file
+        audio_hash: Hash of the MPEG audio data
+    """
+    with _lock:
+        c = _connect().cursor()
+        c.execute('''INSERT OR REPLACE INTO essentia_files (filepath, audio_hash) VALUES (?, ?)''',
+                  (file_path, audio_hash))
+        _commit_later()
+
+
+def rename_essentia_file(old_path, new_path):
+    """Follow a file move in the file → activation vectors mapping.
+    
+    Args:
+        old_path: Previous path of the MP3 file
+        new_path: New path of the MP3 file
+    """
+    with _lock:
+        c = _connect().cursor()
+        c.execute('''UPDATE OR REPLACE essentia_files SET filepath=? WHERE filepath=?''', (new_path, old_path))
+        _commit_later()
+
+
+def get_essentia_file_activations(model):
+    """Fetch stored activation vectors for every known file.
+    
+    Args:
+        model: Identifier of the models that produced the vectors
+        
+    Returns:
+        List of (filepath, genre_activations, mood_activations) tuples with
+        float32 bytes
+    """
+    with _lock:
+        c = _connect().cursor()
+        c.execute('''SELECT f.filepath, a.genre_activations, a.mood_activations
+                     FROM essentia_files f JOIN essentia_activations a ON a.audio_hash = f.audio_hash
+                     WHERE a.model=? ORDER BY f.filepath''', (model,))
+        rows = c.fetchall()
+    return rows
+
+
+def iter_essentia_file_embeddings(model):
+    """Iterate over the stored mean embedding of every known file.
+    
+    Args:
+        model: Identifier of the models that produced the vectors
+        
+    Yields:
+        Tuples of (filepath, embedding float32 bytes)
+    """
+    # A connection of its own: the shared one is not held during the iteration
     conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''INSERT INTO processed_files 
-                                 (filepath, tags_fixed, lyrics_fetched, artwork_generated, gain_applied, essentia_analyzed)
-                                 VALUES (?, ?, ?, ?, ?, ?)
-                 ON CONFLICT(filepath) DO UPDATE SET
-                 tags_fixed = excluded.tags_fixed,
-                 lyrics_fetched = excluded.lyrics_fetched,
-                 artwork_generated = excluded.artwork_generated,
-                 gain_applied = excluded.gain_applied,
-                                 essentia_analyzed = excluded.essentia_analyzed,
-                 last_processed = CURRENT_TIMESTAMP''',
-              (file_path, int(tags_fixed), int(lyrics_fetched), 
-                             int(artwork_generated), int(gain_applied), int(essentia_analyzed)))
-    conn.commit()
-    conn.close()
+    try:
+        c = conn.cursor()
+        c.execute('''SELECT f.filepath, a.embedding
+                     FROM essentia_files f JOIN essentia_activations a ON a.audio_hash = f.audio_hash
+                     WHERE a.model=? AND a.embedding IS NOT NULL ORDER BY f.filepath''', (model,))
+        for row in c:
+            yield row
+    finally:
+        conn.close()
+
+
+def get_artwork_album(album_key):
+    """Fetch the Apple Music album page found for an album.
+    
+    Args:
+        album_key: Normalized "albumartist|album" key
+        
+    Returns:
+        Tuple of (apple_url or None if the search found nothing, checked_at
+        timestamp), or None if the album was never searched
+    """
+    with _lock:
+        c = _connect().cursor()
+        c.execute('SELECT apple_url, checked_at FROM artwork_albums WHERE album_key=?', (album_key,))
+        result = c.fetchone()
+    return result
+
+
+def save_artwork_album(album_key, apple_url, checked_at):
+    """Record the Apple Music album page found for an album (None if none).
+    
+    Args:
+        album_key: Normalized "albumartist|album" key
+        apple_url: Apple Music album URL, or None
+        checked_at: Time of the search (seconds since the epoch)
+    """
+    with _lock:
+        c = _connect().cursor()
+        c.execute('INSERT OR REPLACE INTO artwork_albums (album_key, apple_url, checked_at) VALUES (?, ?, ?)',
+                  (album_key, apple_url, checked_at))
+        _commit_later()
+
+
+def get_artwork_video(apple_url):
+    """Fetch the video stream scraped from an Apple Music album page.
+    
+    Args:
+        apple_url: Apple Music album URL
+        
+    Returns:
+        Tuple of (m3u8 URL or None if the page has no video, checked_at
+        timestamp), or None if the page was never scraped
+    """
+    with _lock:
+        c = _connect().cursor()
+        c.execute('SELECT m3u8_url, checked_at FROM artwork_videos WHERE apple_url=?', (apple_url,))
+        result = c.fetchone()
+    return result
+
+
+def save_artwork_video(apple_url, m3u8_url, checked_at):
+    """Record the video stream of an Apple Music album page (None if no video).
+    
+    Args:
+        apple_url: Apple Music album URL
+        m3u8_url: m3u8 stream URL, or None
+        checked_at: Time of the scrape (seconds since the epoch)
+    """
+    with _lock:
+        c = _connect().cursor()
+        c.execute('INSERT OR REPLACE INTO artwork_videos (apple_url, m3u8_url, checked_at) VALUES (?, ?, ?)',
+                  (apple_url, m3u8_url, checked_at))
+        _commit_later()
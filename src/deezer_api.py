@@ -3,8 +3,85 @@ Deezer API operations.
 Handles searching for tracks and fetching track information from Deezer.
 """
 
-import requests
+import re
+import sys
+from collections import deque
+from difflib import SequenceMatcher
+from itertools import islice
 from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+from . import http_client
+from .config import get_processing_options
+from .response_cache import cache_get, cache_set
+
+# Search hits kept for detail lookups after local ranking
+MAX_CANDIDATES = 5
+# Weights of the local ranking; durations further apart than DURATION_SCALE
+# seconds get the full duration penalty
+TITLE_WEIGHT = 0.5
+ARTIST_WEIGHT = 0.3
+ALBUM_WEIGHT = 0.2
+DURATION_WEIGHT = 0.3
+DURATION_SCALE = 10
+# Score and lead over the runner-up for the top hit to be looked up alone
+CONCLUSIVE_SCORE = 0.9
+CONCLUSIVE_MARGIN = 0.15
+# Candidate track lookups running at the same time for one file, kept below
+# the host's keep-alive pool so every lookup reuses a pooled connection and one
+# is left for the other Deezer calls
+CANDIDATE_FETCH_WORKERS = http_client.POOL_CONNECTIONS_PER_HOST - 1
+# Deezer error code for "no data" (unknown ISRC, ...), a result worth caching
+DEEZER_NO_DATA_ERROR = 800
+# Deezer error code for "Quota limit exceeded", returned with HTTP 200
+DEEZER_QUOTA_ERROR = 4
+# Deezer's quota window in seconds
+DEEZER_QUOTA_WINDOW = 5
+
+
+def _get_json(url):
+    """Fetch a Deezer API payload, served from the response cache when possible.
+    
+    Empty search results and "no data" errors are cached with the shorter
+    negative TTL; other errors are never cached.
+    
+    Args:
+        url: Deezer API URL
+        
+    Returns:
+        Decoded JSON payload, or None if the request failed
+        
+    Raises:
+        HostUnavailableError: If Deezer is down or keeps reporting its quota
+            as exceeded
+    """
+    options = get_processing_options()
+    if options['deezer_cache_ttl'] > 0:
+        hit, data = cache_get(url)
+        if hit:
+            print(f"Deezer cache hit: {url}")
+            return data
+    for attempt in range(http_client.THROTTLE_RETRIES + 1):
+        response = http_client.get(url)
+        if response.status_code != 200:
+            return None
+        data = response.json()
+        error = data.get('error')
+        if not error or error.get('code') != DEEZER_QUOTA_ERROR:
+            break
+        # Quota errors come back as HTTP 200: slow down and wait out the window
+        http_client.report_throttled(url, DEEZER_QUOTA_WINDOW)
+    else:
+        http_client.report_failure(url)
+        raise http_client.HostUnavailableError('api.deezer.com', DEEZER_QUOTA_WINDOW)
+    if error and error.get('code') != DEEZER_NO_DATA_ERROR:
+        print(f"Deezer error: {error.get('message')}", file=sys.stderr)
+        return data
+    if options['deezer_cache_ttl'] <= 0:
+        return data
+    negative = bool(error) or ('data' in data and not data['data'])
+    ttl = options['deezer_cache_negative_ttl'] if negative else options['deezer_cache_ttl']
+    cache_set(url, data, ttl, options['response_cache_max_entries'])
+    return data
 
 
 def search_deezer_track(artist, album, title):
@@ -19,20 +96,18 @@ def search_deezer_track(artist, album, title):
         title: Track title
         
     Returns:
-        List of up to 5 track IDs, or empty list if no results
+        List of search hits (dictionaries with id, title, artist, album,
+        duration and rank), or empty list if no results
     """
     # Try full query first
     query = f"{artist} {album} {title}"
     url = f"https://api.deezer.com/search?q={quote(query)}"
     print(f"Calling Deezer Search URL: {url}")
     
-    response = requests.get(url)
-    if response.status_code == 200:
-        data = response.json()
-        if data.get('data'):
-            track_ids = [track['id'] for track in data['data'][:5]]
-            print(f"Found {len(track_ids)} results with full query")
-            return track_ids
+    data = _get_json(url)
+    if data and data.get('data'):
+        print(f"Found {len(data['data'])} results with full query")
+        return data['data']
     
     # Fallback to simplified query (artist + title only)
     print("No results with full query, trying simplified search...")
@@ -40,17 +115,65 @@ def search_deezer_track(artist, album, title):
     url_simple = f"https://api.deezer.com/search?q={quote(query_simple)}"
     print(f"Calling Deezer Search URL: {url_simple}")
     
-    response_simple = requests.get(url_simple)
-    if response_simple.status_code == 200:
-        data_simple = response_simple.json()
-        if data_simple.get('data'):
-            track_ids = [track['id'] for track in data_simple['data'][:5]]
-            print(f"Found {len(track_ids)} results with simplified query")
-            return track_ids
+    data_simple = _get_json(url_simple)
+    if data_simple and data_simple.get('data'):
+        print(f"Found {len(data_simple['data'])} results with simplified query")
+        return data_simple['data']
     
     return []
 
 
+def _normalize_text(text):
+    """Lowercase, drop "(feat. ...)"-style suffixes and punctuation."""
+    text = (text or '').casefold()
+    text = re.sub(r'[\(\[](feat|ft|with)\b[^\)\]]*[\)\]]', ' ', text)
+    return ' '.join(re.sub(r'[^\w]+', ' ', text).split())
+
+
+def _similarity(a, b):
+    a, b = _normalize_text(a), _normalize_text(b)
+    if not a or not b:
+        return 0.0
+    return SequenceMatcher(None, a, b).ratio()
+
+
+def _hit_score(hit, artist, album, title, duration):
+    score = (TITLE_WEIGHT * _similarity(title, hit.get('title'))
+             + ARTIST_WEIGHT * _similarity(artist, hit.get('artist', {}).get('name'))
+             + ALBUM_WEIGHT * _similarity(album, hit.get('album', {}).get('title')))
+    if duration and hit.get('duration'):
+        distance = abs(hit['duration'] - duration)
+        score -= DURATION_WEIGHT * min(1.0, distance / DURATION_SCALE)
+    return score
+
+
+def rank_deezer_hits(hits, artist, album, title, duration=None):
+    """Rank search hits locally against the file's tags and duration.
+    
+    Args:
+        hits: Search hits returned by search_deezer_track()
+        artist: Artist name
+        album: Album name
+        title: Track title
+        duration: Local track duration in seconds (optional)
+        
+    Returns:
+        Tuple of (up to MAX_CANDIDATES track IDs, most likely first;
+        True if the top hit is a clear winner)
+    """
+    scored = sorted(((_hit_score(hit, artist, album, title, duration), idx, hit) for idx, hit in enumerate(hits)),
+                    key=lambda entry: (-entry[0], entry[1]))
+    scored = scored[:MAX_CANDIDATES]
+    if not scored:
+        return [], False
+    top_score = scored[0][0]
+    second_score = scored[1][0] if len(scored) > 1 else 0.0
+    conclusive = top_score >= CONCLUSIVE_SCORE and top_score - second_score >= CONCLUSIVE_MARGIN
+    print(f"Ranked {len(hits)} Deezer hits, top score {top_score:.2f}"
+          f"{' (conclusive)' if conclusive else ''}")
+    return [hit['id'] for _, _, hit in scored], conclusive
+
+
 def get_deezer_track_info(track_id):
     """Fetch detailed track info from Deezer API.
     
@@ -62,7 +185,123 @@ def get_deezer_track_info(track_id):
     """
     url = f"https://api.deezer.com/track/{track_id}"
     print(f"Calling Deezer Track URL: {url}")
-    response = requests.get(url)
-    if response.status_code == 200:
-        return response.json()
+    data = _get_json(url)
+    if data and not data.get('error'):
+        return data
     return None
+
+
+def iter_deezer_track_infos(track_ids):
+    """Fetch several tracks concurrently, yielding them in the order given.
+    
+    At most CANDIDATE_FETCH_WORKERS lookups are in flight: the next candidate
+    is only requested once the oldest one has arrived. Each track is yielded
+    as soon as it and every earlier one have arrived, so a caller stopping at
+    the first match keeps the ranking of the results, and closing the
+    generator leaves the candidates not yet submitted unrequested (running
+    lookups finish in the background and are discarded).
+    
+    Args:
+        track_ids: Deezer track IDs, best candidate first
+        
+    Yields:
+        Tuples of (track_id, track info or None)
+    """
+    if not track_ids:
+        return
+    executor = ThreadPoolExecutor(max_workers=min(len(track_ids), CANDIDATE_FETCH_WORKERS),
+                                  thread_name_prefix='deezer')
+    try:
+        pending = iter(track_ids)
+        window = deque((track_id, executor.submit(get_deezer_track_info, track_id))
+                       for track_id in islice(pending, CANDIDATE_FETCH_WORKERS))
+        while window:
+            track_id, future = window.popleft()
+            try:
+                info = future.result()
+            except http_client.HostUnavailableError:
+                raise
+            except Exception as e:
+                print(f"Deezer track {track_id} lookup failed: {e}", file=sys.stderr)
+                info = None
+            # Keep the window full while the caller checks this candidate
+            for next_id in islice(pending, 1):
+                window.append((next_id, executor.submit(get_deezer_track_info, next_id)))
+            yield track_id, info
+    finally:
+        executor.shutdown(wait=False)
+
+
+def get_deezer_track_by_isrc(isrc):
+    """Fetch track info from Deezer directly by ISRC.
+    
+    Args:
+        isrc: ISRC code of the track
+        
+    Returns:
+        Dictionary of track info, or None if Deezer has no track with this ISRC
+    """
+    url = f"https://api.deezer.com/track/isrc:{quote(isrc)}"
+    print(f"Calling Deezer ISRC URL: {url}")
+    data = _get_json(url)
+    # Unknown ISRCs come back as HTTP 200 with an error object
+    if data and data.get('id') and not data.get('error'):
+        return data
+    return None
+
+
+def search_deezer_album(artist, album):
+    """Search Deezer for albums matching artist and album name.
+    
+    Args:
+        artist: Album artist name
+        album: Album name
+        
+    Returns:
+        List of album search results (dictionaries), or empty list
+    """
+    url = f"https://api.deezer.com/search/album?q={quote(f'{artist} {album}')}"
+    print(f"Calling Deezer Album Search URL: {url}")
+    data = _get_json(url)
+    if data and data.get('data'):
+        return data['data']
+    return []
+
+
+def get_deezer_album_info(album_id):
+    """Fetch album info (title, artist, release date) from Deezer API.
+    
+    Args:
+        album_id: Deezer album ID
+        
+    Returns:
+        Dictionary of album info, or None on error
+    """
+    url = f"https://api.deezer.com/album/{album_id}"
+    print(f"Calling Deezer Album URL: {url}")
+    data = _get_json(url)
+    if data and not data.get('error'):
+        return data
+    return None
+
+
+def get_deezer_album_tracks(album_id):
+    """Fetch every track of a Deezer album, following pagination.
+    
+    Args:
+        album_id: Deezer album ID
+        
+    Returns:
+        List of track dictionaries (with isrc, disk_number, track_position
+        and duration), or empty list on error
+    """
+    url = f"https://api.deezer.com/album/{album_id}/tracks?limit=500"
+    tracks = []
+    while url:
+        print(f"Calling Deezer Album Tracks URL: {url}")
+        data = _get_json(url)
+        if not data or data.get('error'):
+            break
+        tracks.extend(data.get('data', []))
+        url = data.get('next')
+    return tracks
@@ -1,13 +1,18 @@
 import os
 os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"
 # --- TensorFlow-based Essentia analysis and tag writing ---
+import re
 import sys
 import os
 import json
+import time
+import threading
 import numpy as np
-from essentia.standard import MonoLoader, TensorflowPredictEffnetDiscogs, TensorflowPredict2D
-import essentia
-from .mp3_tags import set_mp3_tag
+# essentia (and the TensorFlow runtime it embeds) is imported when models are
+# first needed, so re-tagging from stored activations never loads it
+from .config import get_processing_options
+from .database import get_essentia_activations, save_essentia_activations, save_essentia_file
+from .mp3_tags import TagSession, get_audio_hash
 
 # Model directory and files (adapt as needed)
 MODEL_DIR = os.path.expanduser('~/essentia_models')
@@ -16,6 +21,8 @@ GENRE_MODEL = f"{MODEL_DIR}/genre_discogs400-discogs-effnet-1.pb"
 GENRE_METADATA = f"{MODEL_DIR}/genre_discogs400-discogs-effnet-1.json"
 MOOD_MODEL = f"{MODEL_DIR}/mtg_jamendo_moodtheme-discogs-effnet-1.pb"
 MOOD_METADATA = f"{MODEL_DIR}/mtg_jamendo_moodtheme-discogs-effnet-1.json"
+# Identifies the models behind cached activation vectors
+MODEL_ID = '+'.join(os.path.splitext(os.path.basename(m))[0] for m in (EMBEDDING_MODEL, GENRE_MODEL, MOOD_MODEL))
 
 # Configurable thresholds
 GENRE_THRESHOLD = 0.15  # 15%
@@ -42,7 +49,30 @@ def format_genre_tag(raw_genre, style='parent_child'):
 def format_mood_tag(raw_mood):
     return raw_mood.title()
 
-def _analyze_with_python_essentia(file_path):
+# Process-wide model registry: graphs and labels are loaded once and reused
+_models = None
+_models_lock = threading.Lock()
+# Essentia algorithm instances are not reentrant
+inference_lock = threading.Lock()
+_timings = {'load_seconds': 0.0, 'inference_seconds': 0.0, 'files': 0}
+
+_labels = None
+
+def get_essentia_labels():
+    """Return (genre_labels, mood_labels) from the model metadata, read once."""
+    global _labels
+    if _labels is None:
+        with open(GENRE_METADATA, 'r') as f:
+            genre_labels = json.load(f)['classes']
+        with open(MOOD_METADATA, 'r') as f:
+            mood_labels = json.load(f)['classes']
+        _labels = (genre_labels, mood_labels)
+    return _labels
+
+def _load_models():
+    """Build the TensorFlow graphs and read the label metadata."""
+    import essentia
+    from essentia.standard import TensorflowPredictEffnetDiscogs, TensorflowPredict2D
     # Disable Essentia logging to avoid cluttering output
     try:
         if hasattr(essentia, 'log'):
@@ -50,81 +80,365 @@ def _analyze_with_python_essentia(file_path):
             essentia.log.warningActive = False
     except Exception:
         pass
-    """Run analysis with python-essentia and return a nested feature dictionary."""
+    embedding_model = TensorflowPredictEffnetDiscogs(graphFilename=EMBEDDING_MODEL, output="PartitionedCall:1")
+    genre_model = TensorflowPredict2D(graphFilename=GENRE_MODEL, input="serving_default_model_Placeholder", output="PartitionedCall")
+    mood_model = TensorflowPredict2D(graphFilename=MOOD_MODEL, input="model/Placeholder", output="model/Sigmoid")
+    genre_labels, mood_labels = get_essentia_labels()
+    return {
+        'embedding_model': embedding_model,
+        'genre_model': genre_model,
+        'genre_labels': genre_labels,
+        'mood_model': mood_model,
+        'mood_labels': mood_labels,
+    }
+
+def get_essentia_models():
+    """Return the shared Essentia models, loading them on first use.
+
+    Returns:
+        Dictionary with the embedding/genre/mood models and their labels,
+        or None if loading failed
+    """
+    global _models
+    with _models_lock:
+        if _models is None:
+            start = time.monotonic()
+            try:
+                _models = _load_models()
+            except Exception as error:
+                print(f"[Essentia] Model loading failed: {error}", file=sys.stderr)
+                return None
+            _timings['load_seconds'] = time.monotonic() - start
+            print(f"[Essentia] Models loaded in {_timings['load_seconds']:.2f}s", file=sys.stderr)
+        return _models
+
+def _load_patch_embedding_model():
+    from essentia.standard import TensorflowPredict
+    return TensorflowPredict(
+        graphFilename=EMBEDDING_MODEL,
+        inputs=['serving_default_melspectrogram'],
+        outputs=['PartitionedCall:1'],
+    )
+
+def get_patch_embedding_model():
+    """Return the effnet graph taking pre-computed mel patches, loading it on first use.
+
+    It is kept in the shared model registry next to the whole-file models,
+    for the batched, windowed and sampled analyses.
+
+    Returns:
+        TensorflowPredict instance, or None if loading failed
+    """
+    models = get_essentia_models()
+    if models is None:
+        return None
+    with _models_lock:
+        if 'patch_embedding_model' not in models:
+            start = time.monotonic()
+            try:
+                models['patch_embedding_model'] = _load_patch_embedding_model()
+            except Exception as error:
+                print(f"[Essentia] Patch embedding model loading failed: {error}", file=sys.stderr)
+                return None
+            elapsed = time.monotonic() - start
+            _timings['load_seconds'] += elapsed
+            print(f"[Essentia] Patch embedding model loaded in {elapsed:.2f}s", file=sys.stderr)
+        return models['patch_embedding_model']
+
+def _uses_patch_embeddings(options):
+    """Whether every analysis embeds pre-computed mel patches (batched or sampled).
+
+    Streaming only applies to tracks past essentia_stream_min_duration, so it
+    loads the patch embedding model on the first streamed track instead.
+    """
+    return options['essentia_batch_size'] > 0 or options['essentia_mode'] == 'sampled'
+
+def warmup_essentia_models():
+    """Load the Essentia models ahead of the first analysis.
+
+    The patch embedding model is loaded too when the batched or sampled
+    analysis is enabled; streamed tracks load it when the first one comes.
+
+    Returns:
+        True if the models are ready, False otherwise
+    """
+    if get_essentia_models() is None:
+        return False
+    if _uses_patch_embeddings(get_processing_options()):
+        return get_patch_embedding_model() is not None
+    return True
+
+def get_essentia_timings():
+    """Return model load time versus cumulated inference time.
+
+    Returns:
+        Dictionary with load_seconds, inference_seconds and files
+    """
+    return dict(_timings)
+
+def record_inference(elapsed, files=1):
+    """Add an inference duration to the load/inference report."""
+    _timings['inference_seconds'] += elapsed
+    _timings['files'] += files
+
+def build_analysis(genre_activations, mood_activations, genre_labels, mood_labels):
+    """Select genre and mood tags from mean model activations.
+
+    Args:
+        genre_activations: Mean genre activations (one value per genre label)
+        mood_activations: Mean mood activations (one value per mood label)
+        genre_labels: Genre labels from the model metadata
+        mood_labels: Mood labels from the model metadata
+
+    Returns:
+        Dictionary with genres, formatted_genres, moods and formatted_moods
+        (callers add 'sampled' and 'audio_hash' once known)
+    """
+    # GENRE
+    top_indices = np.argsort(genre_activations)[::-1][:TOP_N_GENRES * 2]
+    genres = []
+    for idx in top_indices:
+        if len(genres) >= TOP_N_GENRES:
+            break
+        if genre_activations[idx] >= GENRE_THRESHOLD:
+            genres.append({'label': genre_labels[idx], 'confidence': float(genre_activations[idx])})
+    if not genres:
+        top_idx = np.argmax(genre_activations)
+        genres.append({'label': genre_labels[top_idx], 'confidence': float(genre_activations[top_idx])})
+    formatted_genres = [format_genre_tag(g['label'], style=GENRE_FORMAT) for g in genres]
+    # MOOD
+    moods = []
+    for idx, activation in enumerate(mood_activations):
+        if activation >= MOOD_THRESHOLD:
+            moods.append({'label': mood_labels[idx], 'confidence': float(activation)})
+    moods = sorted(moods, key=lambda x: x['confidence'], reverse=True)[:TOP_N_MOODS]
+    formatted_moods = [format_mood_tag(m['label']) for m in moods]
+    return {
+        'genres': genres,
+        'formatted_genres': formatted_genres,
+        'moods': moods,
+        'formatted_moods': formatted_moods,
+    }
+
+def compute_whole_file_activations(file_path, models):
+    """Decode the whole file and return its mean activations and embedding."""
+    from essentia.standard import MonoLoader
+    audio = MonoLoader(filename=str(file_path), sampleRate=16000, resampleQuality=4)()
+    with inference_lock:
+        embeddings = models['embedding_model'](audio)
+        genre_predictions = models['genre_model'](embeddings)
+        mood_predictions = models['mood_model'](embeddings)
+    return np.mean(genre_predictions, axis=0), np.mean(mood_predictions, axis=0), np.mean(embeddings, axis=0)
+
+def choose_analysis_path(file_path, options):
+    """Pick how a file is decoded for analysis.
+
+    Args:
+        file_path: Path to the MP3 file
+        options: Processing options dictionary
+
+    Returns:
+        Tuple of ('sampled' | 'stream' | 'whole', duration in seconds or None)
+    """
+    sampled = options['essentia_mode'] == 'sampled'
+    min_duration = options['essentia_stream_min_duration']
+    if not sampled and min_duration <= 0:
+        return 'whole', None
+    # Only the MPEG headers are needed here, mutagen is the fallback
+    from .mp3_probe import probe_duration
+    duration = probe_duration(file_path)
+    if duration is None:
+        from .mp3_tags import get_audio_duration
+        duration = get_audio_duration(file_path)
+    if not duration:
+        return 'whole', duration
+    # Tracks shorter than the segments themselves are analyzed in full
+    if sampled and duration > options['essentia_sample_segments'] * options['essentia_sample_seconds']:
+        return 'sampled', duration
+    if min_duration > 0 and duration >= min_duration:
+        return 'stream', duration
+    return 'whole', duration
+
+def compute_activations(file_path, models):
+    """Return mean genre/mood activations and the mean embedding of a file.
+
+    In sampled mode only ESSENTIA_SAMPLE_SEGMENTS evenly spaced segments are
+    decoded. Tracks longer than ESSENTIA_STREAM_MIN_DURATION are decoded and
+    embedded in windows so peak memory does not grow with track length.
+
+    Args:
+        file_path: Path to the MP3 file
+        models: Models returned by get_essentia_models()
+
+    Returns:
+        Tuple of (genre_activations, mood_activations, embedding, sampled)
+    """
+    options = get_processing_options()
+    path, duration = choose_analysis_path(file_path, options)
+    if path == 'sampled':
+        from .essentia_stream import compute_sampled_activations
+        print(f"[Essentia] Sampled analysis ({options['essentia_sample_segments']}x"
+              f"{options['essentia_sample_seconds']}s)", file=sys.stderr)
+        activations = compute_sampled_activations(
+            file_path, models, duration, options['essentia_sample_segments'], options['essentia_sample_seconds'])
+        return (*activations, True)
+    if path == 'stream':
+        from .essentia_stream import compute_streaming_activations
+        print(f"[Essentia] Long track ({duration}s), using streaming analysis", file=sys.stderr)
+        return (*compute_streaming_activations(file_path, models), False)
+    return (*compute_whole_file_activations(file_path, models), False)
+
+def load_cached_activations(audio_hash, allow_sampled=False):
+    """Return cached (genre_activations, mood_activations, embedding, sampled) or None."""
+    if not audio_hash:
+        return None
     try:
-        # Load models
-        embedding_model = TensorflowPredictEffnetDiscogs(graphFilename=EMBEDDING_MODEL, output="PartitionedCall:1")
-        genre_model = TensorflowPredict2D(graphFilename=GENRE_MODEL, input="serving_default_model_Placeholder", output="PartitionedCall")
-        with open(GENRE_METADATA, 'r') as f:
-            genre_labels = json.load(f)['classes']
-        mood_model = TensorflowPredict2D(graphFilename=MOOD_MODEL, input="model/Placeholder", output="model/Sigmoid")
-        with open(MOOD_METADATA, 'r') as f:
-            mood_labels = json.load(f)['classes']
+        row = get_essentia_activations(audio_hash, MODEL_ID, allow_sampled)
     except Exception as error:
-        print(f"[Essentia] Model loading failed: {error}", file=sys.stderr)
+        print(f"[Essentia] Activation cache lookup failed: {error}", file=sys.stderr)
         return None
+    if not row:
+        return None
+    return (*(np.frombuffer(blob, dtype=np.float32) for blob in row[:3]), bool(row[3]))
+
+def store_activations(audio_hash, genre_activations, mood_activations, embedding, sampled=False):
+    """Persist activation vectors so re-tagging never needs the audio again."""
+    if not audio_hash:
+        return
     try:
-        audio = MonoLoader(filename=str(file_path), sampleRate=16000, resampleQuality=4)()
-        embeddings = embedding_model(audio)
-        # GENRE
-        genre_predictions = genre_model(embeddings)
-        genre_activations = np.mean(genre_predictions, axis=0)
-        top_indices = np.argsort(genre_activations)[::-1][:TOP_N_GENRES * 2]
-        genres = []
-        for idx in top_indices:
-            if len(genres) >= TOP_N_GENRES:
-                break
-            if genre_activations[idx] >= GENRE_THRESHOLD:
-                genres.append({'label': genre_labels[idx], 'confidence': float(genre_activations[idx])})
-        if not genres:
-            top_idx = np.argmax(genre_activations)
-            genres.append({'label': genre_labels[top_idx], 'confidence': float(genre_activations[top_idx])})
-        formatted_genres = [format_genre_tag(g['label'], style=GENRE_FORMAT) for g in genres]
-        # MOOD
-        mood_predictions = mood_model(embeddings)
-        mood_activations = np.mean(mood_predictions, axis=0)
-        moods = []
-        for idx, activation in enumerate(mood_activations):
-            if activation >= MOOD_THRESHOLD:
-                moods.append({'label': mood_labels[idx], 'confidence': float(activation)})
-        moods = sorted(moods, key=lambda x: x['confidence'], reverse=True)[:TOP_N_MOODS]
-        formatted_moods = [format_mood_tag(m['label']) for m in moods]
-        return {
-            'genres': genres,
-            'formatted_genres': formatted_genres,
-            'moods': moods,
-            'formatted_moods': formatted_moods,
-        }
+        save_essentia_activations(
+            audio_hash, MODEL_ID,
+            np.asarray(genre_activations, dtype=np.float32).tobytes(),
+            np.asarray(mood_activations, dtype=np.float32).tobytes(),
+            np.asarray(embedding, dtype=np.float32).tobytes(),
+            sampled,
+        )
+    except Exception as error:
+        print(f"[Essentia] Could not store activations: {error}", file=sys.stderr)
+
+def analysis_from_cache(cached, audio_hash):
+    """Build an analysis from cached vectors (pure NumPy, no decoding or inference)."""
+    analysis = build_analysis(cached[0], cached[1], *get_essentia_labels())
+    analysis['sampled'] = cached[3]
+    analysis['audio_hash'] = audio_hash
+    return analysis
+
+def select_top_labels(activations, top_n, threshold, fallback_to_best=False):
+    """Vectorized tag selection over a (tracks x labels) activation matrix.
+
+    Mirrors build_analysis: per track, the top_n labels by activation that
+    reach threshold, optionally falling back to the best label.
+
+    Args:
+        activations: 2D array of mean activations, one row per track
+        top_n: Maximum number of labels per track
+        threshold: Minimum activation for a label to be kept
+        fallback_to_best: Keep the best label when none reaches threshold
+
+    Returns:
+        Tuple of (indices, keep) arrays of shape (tracks, top_n): label
+        indices by decreasing activation and whether each one is selected
+    """
+    indices = np.argsort(-activations, axis=1, kind='stable')[:, :top_n]
+    keep = np.take_along_axis(activations, indices, axis=1) >= threshold
+    if fallback_to_best:
+        keep[:, 0] |= ~keep.any(axis=1)
+    return indices, keep
+
+def _analyze_with_python_essentia(file_path):
+    """Run analysis with python-essentia and return a nested feature dictionary."""
+    audio_hash = get_audio_hash(file_path)
+    cached = load_cached_activations(audio_hash, get_processing_options()['essentia_mode'] == 'sampled')
+    if cached is not None:
+        # Pure NumPy re-tag from stored vectors, no decoding or inference
+        print("[Essentia] Using cached activations", file=sys.stderr)
+        try:
+            return analysis_from_cache(cached, audio_hash)
+        except Exception as error:
+            print(f"[Essentia] Analysis failed: {error}", file=sys.stderr)
+            return None
+    models = get_essentia_models()
+    if models is None:
+        return None
+    try:
+        start = time.monotonic()
+        genre_activations, mood_activations, embedding, sampled = compute_activations(file_path, models)
+        store_activations(audio_hash, genre_activations, mood_activations, embedding, sampled)
+        analysis = build_analysis(genre_activations, mood_activations, models['genre_labels'], models['mood_labels'])
+        analysis['sampled'] = sampled
+        analysis['audio_hash'] = audio_hash
+        elapsed = time.monotonic() - start
+        record_inference(elapsed)
+        print(f"[Essentia] Inference took {elapsed:.2f}s (model load: {_timings['load_seconds']:.2f}s, once)", file=sys.stderr)
+        return analysis
     except Exception as error:
         print(f"[Essentia] Analysis failed: {error}", file=sys.stderr)
         return None
 
-def analyze_with_essentia(file_path, stats=None):
-    print(f"Running Python Essentia analysis on: {file_path}", file=sys.stderr)
-    analysis = _analyze_with_python_essentia(file_path)
+def essentia_mood_vocabulary():
+    """Return the set of mood tags Essentia can produce."""
+    return {format_mood_tag(label) for label in get_essentia_labels()[1]}
+
+def split_moods(values):
+    """Split mood tag values ("Happy; Sad", "Happy, Sad") into single moods."""
+    return [m.strip() for val in values for m in re.split(r"[;,]", val) if m.strip()]
+
+def write_essentia_tags(file_path, analysis, stats=None, replace_moods=False, mp3=None):
+    """Write an Essentia analysis result to the MP3 genre and mood tags.
+
+    Args:
+        file_path: Path to the MP3 file
+        analysis: Analysis dictionary, or None if the analysis failed
+        stats: Statistics dictionary (optional)
+        replace_moods: Drop moods from a previous Essentia analysis instead
+            of merging with them (moods from other sources are kept)
+        mp3: Parsed MP3 file (Mp3File) to write through instead of parsing
+            the file again
+
+    Returns:
+        True if tags were written, False otherwise
+    """
     if analysis is None:
         print("[Essentia] Analysis failed.", file=sys.stderr)
         return False
 
-    # Write tags using your mp3_tags system
+    # Genre and mood are written with a single save
+    with (mp3.session() if mp3 is not None else TagSession(file_path)) as session:
+        # Écrase le tag genre avec les genres Essentia uniquement
+        if analysis.get('formatted_genres'):
+            session.set('genre', "; ".join(analysis['formatted_genres']))
 
-    # Écrase le tag genre avec les genres Essentia uniquement
-    if analysis.get('formatted_genres'):
-        set_mp3_tag(file_path, 'genre', "; ".join(analysis['formatted_genres']))
+        # Integrate Essentia moods with existing ones (without duplicates)
+        if analysis.get('formatted_moods'):
+            existing_moods = split_moods(session.get('mood'))
+            if replace_moods:
+                vocabulary = essentia_mood_vocabulary()
+                existing_moods = [m for m in existing_moods if m not in vocabulary]
+            all_moods = existing_moods + analysis['formatted_moods']
+            seen = set()
+            merged_moods = [m for m in all_moods if not (m in seen or seen.add(m))]
+            session.set('mood', "; ".join(merged_moods))
+    if session.failed:
+        return False
 
-    # Integrate Essentia moods with existing ones (without duplicates)
-    if analysis.get('formatted_moods'):
-        from .mp3_tags import get_mp3_tags
-        tags, *_ = get_mp3_tags(file_path)
-        existing_moods = tags.get('mood', [])
-        existing_moods = [m.strip() for val in existing_moods for m in val.split(',') if m.strip()]
-        all_moods = existing_moods + analysis['formatted_moods']
-        seen = set()
-        merged_moods = [m for m in all_moods if not (m in seen or seen.add(m))]
-        set_mp3_tag(file_path, 'mood', "; ".join(merged_moods))
+    # Remember which stored vectors belong to this file for library-wide re-tags
+    if analysis.get('audio_hash'):
+        try:
+            save_essentia_file(file_path, analysis['audio_hash'])
+        except Exception as error:
+            print(f"[Essentia] Could not record activations for {file_path}: {error}", file=sys.stderr)
 
     if stats is not None and 'essentia_analyzed' in stats:
         stats['essentia_analyzed'] += 1
 
     print("Essentia analysis completed and ID3 tags updated", file=sys.stderr)
     return True
+
+def run_essentia_analysis(file_path):
+    """Analyze a file in this process and return the analysis dictionary (or None)."""
+    print(f"Running Python Essentia analysis on: {file_path}", file=sys.stderr)
+    return _analyze_with_python_essentia(file_path)
+
+def analyze_with_essentia(file_path, stats=None):
+    analysis = run_essentia_analysis(file_path)
+    return write_essentia_tags(file_path, analysis, stats)
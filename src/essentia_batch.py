@@ -0,0 +1,254 @@
+"""
+Batched cross-file Essentia inference.
+Collects the mel patches of several decoded tracks and runs the discogs-effnet
+embedding model on large fixed-size batches, then splits the genre/mood
+activations back out per file.
+"""
+
+import sys
+import time
+import threading
+import numpy as np
+from essentia import Pool
+from essentia.standard import MonoLoader, FrameGenerator, TensorflowInputMusiCNN
+from .config import get_processing_options
+from .mp3_tags import get_audio_hash
+from .essentia_analysis import (
+    inference_lock, get_essentia_models, get_patch_embedding_model, record_inference, build_analysis,
+    choose_analysis_path, load_cached_activations, store_activations, analysis_from_cache,
+    _analyze_with_python_essentia,
+)
+
+# discogs-effnet-bs64 has a fixed batch dimension of 64 patches
+MODEL_BATCH_SIZE = 64
+FRAME_SIZE = 512
+HOP_SIZE = 256
+PATCH_SIZE = 128
+PATCH_HOP_SIZE = 62
+NUMBER_BANDS = 96
+
+def compute_mel_patches(audio):
+    """Cut 16 kHz mono audio into the mel patches expected by discogs-effnet.
+
+    Args:
+        audio: Mono float32 audio sampled at 16 kHz
+
+    Returns:
+        Array of shape (patches, PATCH_SIZE, NUMBER_BANDS)
+    """
+    mel = TensorflowInputMusiCNN()
+    frames = [mel(frame) for frame in FrameGenerator(audio, frameSize=FRAME_SIZE, hopSize=HOP_SIZE,
+                                                      startFromZero=True, validFrameThresholdRatio=1)]
+    if len(frames) < PATCH_SIZE:
+        return np.zeros((0, PATCH_SIZE, NUMBER_BANDS), dtype=np.float32)
+    bands = np.asarray(frames, dtype=np.float32)
+    starts = range(0, len(bands) - PATCH_SIZE + 1, PATCH_HOP_SIZE)
+    return np.stack([bands[start:start + PATCH_SIZE] for start in starts])
+
+
+def embed_patches(patches):
+    """Run the effnet graph over patches, MODEL_BATCH_SIZE at a time.
+
+    Only the last model batch is zero-padded.
+
+    Args:
+        patches: Array of shape (patches, PATCH_SIZE, NUMBER_BANDS)
+
+    Returns:
+        Embeddings array of shape (patches, 1280)
+    """
+    model = get_patch_embedding_model()
+    if model is None:
+        raise RuntimeError("patch embedding model unavailable")
+    embeddings = []
+    for start in range(0, len(patches), MODEL_BATCH_SIZE):
+        chunk = patches[start:start + MODEL_BATCH_SIZE]
+        count = len(chunk)
+        if count < MODEL_BATCH_SIZE:
+            padding = np.zeros((MODEL_BATCH_SIZE - count, PATCH_SIZE, NUMBER_BANDS), dtype=np.float32)
+            chunk = np.concatenate([chunk, padding])
+        pool = Pool()
+        pool.set('serving_default_melspectrogram', chunk[:, np.newaxis, :, :])
+        output = model(pool)['PartitionedCall:1']
+        embeddings.append(np.reshape(output, (MODEL_BATCH_SIZE, -1))[:count])
+    return np.concatenate(embeddings)
+
+
+class EssentiaBatcher:
+    """Background batcher for Essentia inference across files.
+
+    Callers decode tracks and submit their mel patches; a worker thread runs
+    the embedding model once enough patches are queued (or the oldest job has
+    waited long enough) and hands each file's analysis to its callback.
+    """
+
+    def __init__(self, batch_size, max_wait):
+        """Initialize the batcher.
+
+        Args:
+            batch_size: Number of patches that triggers a batch (rounded up to
+                a multiple of MODEL_BATCH_SIZE)
+            max_wait: Maximum time in seconds a submitted file waits for a batch
+        """
+        self.batch_size = max(MODEL_BATCH_SIZE, -(-batch_size // MODEL_BATCH_SIZE) * MODEL_BATCH_SIZE)
+        self.max_wait = max_wait
+        self._pending = []
+        self._pending_patches = 0
+        self._running = False
+        self._flush_requested = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='essentia-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, file_path, callback):
+        """Decode a file and queue its patches for the next batch.
+
+        Blocks while too many patches are already queued. Tracks long enough
+        for streaming analysis are analyzed right away instead.
+
+        Args:
+            file_path: Path to the MP3 file
+            callback: Called with the analysis dictionary (or None on failure)
+                from the batcher thread
+        """
+        options = get_processing_options()
+        audio_hash = get_audio_hash(file_path)
+        cached = load_cached_activations(audio_hash, options['essentia_mode'] == 'sampled')
+        if cached is not None:
+            print(f"[Essentia] Using cached activations for {file_path}", file=sys.stderr)
+            _run_callback(callback, analysis_from_cache(cached, audio_hash))
+            return
+        try:
+            path, duration = choose_analysis_path(file_path, options)
+            if path == 'stream':
+                # Long tracks would blow the batch memory budget: stream them inline
+                _run_callback(callback, _analyze_with_python_essentia(file_path))
+                return
+            if path == 'sampled':
+                from .essentia_stream import compute_sampled_patches
+                patches = compute_sampled_patches(
+                    file_path, duration, options['essentia_sample_segments'], options['essentia_sample_seconds'])
+            else:
+                audio = MonoLoader(filename=str(file_path), sampleRate=16000, resampleQuality=4)()
+                patches = compute_mel_patches(audio)
+        except Exception as error:
+            print(f"[Essentia] Decoding failed for {file_path}: {error}", file=sys.stderr)
+            _run_callback(callback, None)
+            return
+        if not len(patches):
+            print(f"[Essentia] Track too short for analysis: {file_path}", file=sys.stderr)
+            _run_callback(callback, None)
+            return
+        job = {
+            'file_path': file_path,
+            'audio_hash': audio_hash,
+            'patches': patches,
+            'sampled': path == 'sampled',
+            'callback': callback,
+            'queued_at': time.monotonic(),
+        }
+        with self._cond:
+            while self._pending_patches >= 4 * self.batch_size:
+                self._cond.wait()
+            self._pending.append(job)
+            self._pending_patches += len(patches)
+            self._cond.notify_all()
+
+    def flush(self):
+        """Run the queued batch immediately and wait until every job is done."""
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify_all()
+            while self._pending or self._running:
+                self._cond.wait()
+            self._flush_requested = False
+
+    def _batch_ready(self):
+        if not self._pending:
+            return False
+        if self._flush_requested or self._pending_patches >= self.batch_size:
+            return True
+        return time.monotonic() - self._pending[0]['queued_at'] >= self.max_wait
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._batch_ready():
+                    timeout = None
+                    if self._pending:
+                        timeout = max(0.0, self._pending[0]['queued_at'] + self.max_wait - time.monotonic())
+                    self._cond.wait(timeout)
+                jobs = self._pending
+                self._pending = []
+                self._pending_patches = 0
+                self._running = True
+                self._cond.notify_all()
+            try:
+                self._process(jobs)
+            finally:
+                with self._cond:
+                    self._running = False
+                    self._cond.notify_all()
+
+    def _process(self, jobs):
+        """Embed all queued patches together and dispatch per-file results."""
+        models = get_essentia_models()
+        if models is None:
+            for job in jobs:
+                _run_callback(job['callback'], None)
+            return
+        try:
+            start = time.monotonic()
+            patches = np.concatenate([job['patches'] for job in jobs])
+            with inference_lock:
+                embeddings = embed_patches(patches)
+                genre_predictions = np.asarray(models['genre_model'](embeddings))
+                mood_predictions = np.asarray(models['mood_model'](embeddings))
+            elapsed = time.monotonic() - start
+            record_inference(elapsed, files=len(jobs))
+            print(f"[Essentia] Batch of {len(jobs)} files ({len(patches)} patches) embedded in {elapsed:.2f}s", file=sys.stderr)
+        except Exception as error:
+            print(f"[Essentia] Batch analysis failed: {error}", file=sys.stderr)
+            for job in jobs:
+                _run_callback(job['callback'], None)
+            return
+
+        offset = 0
+        for job in jobs:
+            end = offset + len(job['patches'])
+            genre_activations = np.mean(genre_predictions[offset:end], axis=0)
+            mood_activations = np.mean(mood_predictions[offset:end], axis=0)
+            store_activations(job['audio_hash'], genre_activations, mood_activations,
+                              np.mean(embeddings[offset:end], axis=0), job['sampled'])
+            analysis = build_analysis(genre_activations, mood_activations, models['genre_labels'], models['mood_labels'])
+            analysis['sampled'] = job['sampled']
+            analysis['audio_hash'] = job['audio_hash']
+            offset = end
+            _run_callback(job['callback'], analysis)
+
+
+def _run_callback(callback, analysis):
+    try:
+        callback(analysis)
+    except Exception as error:
+        print(f"[Essentia] Error handling batch result: {error}", file=sys.stderr)
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def get_essentia_batcher(batch_size, max_wait):
+    """Return the process-wide batcher, creating it on first use."""
+    global _batcher
+    with _batcher_lock:
+        if _batcher is None:
+            _batcher = EssentiaBatcher(batch_size, max_wait)
+            print(f"[Essentia] Batching enabled ({_batcher.batch_size} patches, max wait {max_wait}s)", file=sys.stderr)
+        return _batcher
+
+
+def flush_essentia_batches():
+    """Wait for every queued batch to complete (no-op if batching never started)."""
+    if _batcher is not None:
+        _batcher.flush()
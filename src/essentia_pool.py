@@ -0,0 +1,157 @@
+"""
+Process pool for Essentia analysis.
+Each worker process loads the Essentia models once and runs TensorFlow with a
+fixed share of intra-op/inter-op threads; analyses are sent back to the parent,
+which writes the tags.
+"""
+
+import os
+import sys
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from .database import flush_db
+
+_timings = {'load_seconds': 0.0, 'inference_seconds': 0.0, 'files': 0}
+_timings_lock = threading.Lock()
+
+
+def available_cores():
+    """Return the number of cores this process may run on (honours cpusets)."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def resolve_worker_count(workers, threads_per_worker):
+    """Resolve the ESSENTIA_WORKERS setting to a worker count.
+
+    Args:
+        workers: Configured worker count, or 'auto' to scale with available cores
+        threads_per_worker: TensorFlow intra-op threads given to each worker
+
+    Returns:
+        Number of worker processes (0 means inline analysis)
+    """
+    if str(workers).lower() == 'auto':
+        return max(1, available_cores() // max(1, threads_per_worker))
+    return max(0, int(workers))
+
+
+def _init_worker(intra_op_threads, inter_op_threads):
+    """Pin TensorFlow thread pools, then load the models once for this worker."""
+    # Must be set before TensorFlow creates its session thread pools
+    os.environ['TF_NUM_INTRAOP_THREADS'] = str(intra_op_threads)
+    os.environ['TF_NUM_INTEROP_THREADS'] = str(inter_op_threads)
+    os.environ['OMP_NUM_THREADS'] = str(intra_op_threads)
+    # A pending group commit here would hold the database write lock against the parent
+    os.environ['DB_COMMIT_BATCH'] = '1'
+    from .essentia_analysis import warmup_essentia_models
+    warmup_essentia_models()
+
+
+def _analyze_in_worker(file_path):
+    """Worker entry point: analyze a file and return picklable results."""
+    from .essentia_analysis import _analyze_with_python_essentia, get_essentia_timings
+    before = get_essentia_timings()
+    analysis = _analyze_with_python_essentia(file_path)
+    after = get_essentia_timings()
+    return analysis, after['load_seconds'], after['inference_seconds'] - before['inference_seconds']
+
+
+class EssentiaPool:
+    """Bounded pool of Essentia worker processes."""
+
+    def __init__(self, workers, threads_per_worker):
+        """Start the worker processes.
+
+        Args:
+            workers: Number of worker processes
+            threads_per_worker: TensorFlow intra-op threads per worker
+        """
+        self.workers = workers
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            # TensorFlow does not survive fork() once initialized
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(threads_per_worker, 1),
+        )
+        # Keep the scan loop at most a couple of files ahead of each worker
+        self._slots = threading.BoundedSemaphore(workers * 2)
+        self._in_flight = 0
+        self._cond = threading.Condition()
+
+    def submit(self, file_path, callback):
+        """Queue a file for analysis in a worker process.
+
+        Args:
+            file_path: Path to the MP3 file
+            callback: Called in the parent with the analysis dictionary
+                (or None on failure)
+        """
+        self._slots.acquire()
+        # The worker writes the activation cache: release our write lock first
+        flush_db()
+        try:
+            future = self._executor.submit(_analyze_in_worker, file_path)
+        except Exception:
+            self._slots.release()
+            raise
+        with self._cond:
+            self._in_flight += 1
+        future.add_done_callback(lambda f: self._on_done(f, file_path, callback))
+
+    def _on_done(self, future, file_path, callback):
+        analysis = None
+        try:
+            analysis, load_seconds, inference_seconds = future.result()
+            with _timings_lock:
+                _timings['load_seconds'] = max(_timings['load_seconds'], load_seconds)
+                _timings['inference_seconds'] += inference_seconds
+                _timings['files'] += 1
+        except Exception as error:
+            print(f"[Essentia] Worker failed on {file_path}: {error}", file=sys.stderr)
+        try:
+            callback(analysis)
+        except Exception as error:
+            print(f"[Essentia] Error handling worker result: {error}", file=sys.stderr)
+        finally:
+            self._slots.release()
+            with self._cond:
+                self._in_flight -= 1
+                self._cond.notify_all()
+
+    def wait(self):
+        """Wait until every submitted analysis has been handled."""
+        with self._cond:
+            while self._in_flight:
+                self._cond.wait()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_essentia_pool(workers, threads_per_worker):
+    """Return the process-wide Essentia pool, starting it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = EssentiaPool(workers, threads_per_worker)
+            print(f"[Essentia] Started {workers} worker processes "
+                  f"({threads_per_worker} TensorFlow threads each)", file=sys.stderr)
+        return _pool
+
+
+def wait_for_essentia_pool():
+    """Wait for in-flight worker analyses (no-op if the pool never started)."""
+    if _pool is not None:
+        _pool.wait()
+
+
+def get_essentia_pool_timings():
+    """Return model load time versus cumulated inference time across workers."""
+    with _timings_lock:
+        return dict(_timings)
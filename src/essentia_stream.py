@@ -0,0 +1,182 @@
+"""
+Bounded-memory Essentia analysis for long tracks and sampled segments.
+Decodes audio through an ffmpeg pipe in overlapping windows, embeds each window
+and keeps running sums of the genre/mood activations, so peak memory is fixed
+regardless of track length. The sampled mode decodes only a few evenly spaced
+segments of each track.
+"""
+
+import sys
+import subprocess
+import numpy as np
+from .essentia_analysis import inference_lock
+from .essentia_batch import (
+    compute_mel_patches, embed_patches, MODEL_BATCH_SIZE, FRAME_SIZE, HOP_SIZE, PATCH_SIZE, PATCH_HOP_SIZE,
+)
+
+SAMPLE_RATE = 16000
+# Patches embedded per window (~63 s of audio per model batch)
+WINDOW_PATCHES = MODEL_BATCH_SIZE
+# Samples needed past the last patch start for a window to produce exactly
+# WINDOW_PATCHES patches, identical to the ones a whole-file pass would produce
+WINDOW_OVERLAP = (PATCH_SIZE - PATCH_HOP_SIZE) * HOP_SIZE + (FRAME_SIZE - HOP_SIZE)
+
+
+def iter_audio_windows(file_path, window_patches=WINDOW_PATCHES):
+    """Yield overlapping 16 kHz mono windows decoded by ffmpeg.
+
+    Window starts are aligned on patch boundaries and consecutive windows
+    overlap by WINDOW_OVERLAP samples, so patches are never split or repeated.
+
+    Args:
+        file_path: Path to the audio file
+        window_patches: Number of patches each window produces
+
+    Yields:
+        float32 numpy arrays of at most advance + WINDOW_OVERLAP samples
+    """
+    advance = window_patches * PATCH_HOP_SIZE * HOP_SIZE
+    cmd = [
+        'ffmpeg', '-v', 'error', '-nostdin',
+        '-i', str(file_path),
+        '-f', 'f32le', '-ac', '1', '-ar', str(SAMPLE_RATE),
+        '-',
+    ]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        carry = np.zeros(0, dtype=np.float32)
+        # The first window has no carried samples, so it reads the overlap too
+        to_read = advance + WINDOW_OVERLAP
+        while True:
+            data = proc.stdout.read(to_read * 4)
+            if not data:
+                break
+            chunk = np.frombuffer(data[:len(data) - len(data) % 4], dtype=np.float32)
+            window = np.concatenate([carry, chunk])
+            yield window
+            if len(data) < to_read * 4:
+                break  # End of stream
+            carry = window[-WINDOW_OVERLAP:].copy()
+            to_read = advance
+        proc.stdout.close()
+        if proc.wait() != 0:
+            raise RuntimeError(f"ffmpeg decoding failed with exit code {proc.returncode}")
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+
+
+def compute_streaming_activations(file_path, models, window_patches=WINDOW_PATCHES):
+    """Return mean activations and embedding computed window by window.
+
+    Args:
+        file_path: Path to the audio file
+        models: Models returned by get_essentia_models()
+        window_patches: Number of patches embedded per window
+
+    Returns:
+        Tuple of (genre_activations, mood_activations, embedding)
+    """
+    genre_sum = None
+    mood_sum = None
+    embedding_sum = None
+    count = 0
+    for window in iter_audio_windows(file_path, window_patches):
+        patches = compute_mel_patches(window)
+        if not len(patches):
+            continue
+        with inference_lock:
+            embeddings = embed_patches(patches)
+            genre_predictions = np.asarray(models['genre_model'](embeddings), dtype=np.float64)
+            mood_predictions = np.asarray(models['mood_model'](embeddings), dtype=np.float64)
+        if genre_sum is None:
+            genre_sum = np.zeros(genre_predictions.shape[1])
+            mood_sum = np.zeros(mood_predictions.shape[1])
+            embedding_sum = np.zeros(embeddings.shape[1])
+        genre_sum += genre_predictions.sum(axis=0)
+        mood_sum += mood_predictions.sum(axis=0)
+        embedding_sum += embeddings.sum(axis=0, dtype=np.float64)
+        count += len(patches)
+    if not count:
+        raise RuntimeError("track too short for analysis")
+    return tuple((total / count).astype(np.float32) for total in (genre_sum, mood_sum, embedding_sum))
+
+
+def decode_segment(file_path, start, seconds):
+    """Decode one segment of a file to 16 kHz mono with ffmpeg input seeking.
+
+    Args:
+        file_path: Path to the audio file
+        start: Segment start in seconds
+        seconds: Segment length in seconds
+
+    Returns:
+        float32 numpy array
+    """
+    cmd = [
+        'ffmpeg', '-v', 'error', '-nostdin',
+        '-ss', f"{start:.3f}", '-t', f"{seconds:.3f}",
+        '-i', str(file_path),
+        '-f', 'f32le', '-ac', '1', '-ar', str(SAMPLE_RATE),
+        '-',
+    ]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+    data = result.stdout
+    return np.frombuffer(data[:len(data) - len(data) % 4], dtype=np.float32)
+
+
+def compute_sampled_patches(file_path, duration, segments, seconds):
+    """Return the mel patches of `segments` evenly spaced segments of a track.
+
+    Args:
+        file_path: Path to the audio file
+        duration: Track duration in seconds
+        segments: Number of segments
+        seconds: Length of each segment in seconds
+
+    Returns:
+        Array of shape (patches, PATCH_SIZE, NUMBER_BANDS)
+    """
+    spacing = duration / segments
+    patches = []
+    for index in range(segments):
+        # Centre each segment in its share of the track
+        start = index * spacing + max(0.0, (spacing - seconds) / 2)
+        patches.append(compute_mel_patches(decode_segment(file_path, start, seconds)))
+    return np.concatenate(patches)
+
+
+def compute_sampled_activations(file_path, models, duration, segments, seconds):
+    """Return mean activations and embedding over sampled segments only.
+
+    Args:
+        file_path: Path to the audio file
+        models: Models returned by get_essentia_models()
+        duration: Track duration in seconds
+        segments: Number of segments
+        seconds: Length of each segment in seconds
+
+    Returns:
+        Tuple of (genre_activations, mood_activations, embedding)
+    """
+    patches = compute_sampled_patches(file_path, duration, segments, seconds)
+    if not len(patches):
+        raise RuntimeError("segments too short for analysis")
+    with inference_lock:
+        embeddings = embed_patches(patches)
+        genre_predictions = models['genre_model'](embeddings)
+        mood_predictions = models['mood_model'](embeddings)
+    return np.mean(genre_predictions, axis=0), np.mean(mood_predictions, axis=0), np.mean(embeddings, axis=0)
+
+
+if __name__ == "__main__":
+    # Check streaming results against the whole-file analysis:
+    #   python -m src.essentia_stream <file.mp3> [<file.mp3> ...]
+    from .essentia_analysis import get_essentia_models, compute_whole_file_activations
+    models = get_essentia_models()
+    for path in sys.argv[1:]:
+        whole_genre, whole_mood, _ = compute_whole_file_activations(path, models)
+        stream_genre, stream_mood, _ = compute_streaming_activations(path, models)
+        print(f"{path}: max |diff| genre={np.max(np.abs(whole_genre - stream_genre)):.5f} "
+              f"mood={np.max(np.abs(whole_mood - stream_mood)):.5f}")
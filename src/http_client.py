@@ -0,0 +1,338 @@
+"""
+Shared HTTP client for Deezer, lrclib, Apple Music and Audiomuse-AI calls.
+One requests session keeps a keep-alive connection pool per host, applies
+default connect/read timeouts and per-host retry with backoff, and counts
+requests, connection reuses and latency per host.
+
+Each host also gets an adaptive token bucket (slowed down on 429s and quota
+errors, sped back up on success) and a circuit breaker that makes calls fail
+fast with HostUnavailableError while the host is down.
+"""
+
+import sys
+import time
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from .config import get_processing_options
+
+# Hosts with their own retry policy (retries, backoff factor); others use the defaults
+HOST_RETRY_POLICIES = {
+    'api.deezer.com': (3, 0.5),
+    'lrclib.net': (2, 1.0),
+    'music.apple.com': (2, 1.0),
+}
+# Transient statuses worth retrying; only idempotent methods are retried.
+# 429 is handled by the rate limiter instead
+RETRY_STATUSES = (500, 502, 503, 504)
+# Sustainable request rates per host (requests per second); others are unlimited
+HOST_RATE_LIMITS = {
+    'api.deezer.com': 50 / 5,
+    'lrclib.net': 5,
+    'music.apple.com': 2,
+    'duckduckgo.com': 0.5,
+}
+# Throttled responses retried by the limiter before giving up on a request
+THROTTLE_RETRIES = 3
+# Lowest fraction of the configured rate a throttled host is slowed down to
+MIN_RATE_FRACTION = 0.1
+# Fraction of the configured rate regained after each successful request
+RATE_RECOVERY_STEP = 0.05
+# Consecutive failures that open a host's circuit, and how long it stays open
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 60
+BREAKER_MAX_COOLDOWN = 900
+# Host pools kept alive per adapter, and connections kept alive per host (the
+# Deezer candidate lookups size their concurrency from it)
+POOL_HOSTS = 10
+POOL_CONNECTIONS_PER_HOST = 4
+
+_session = None
+_session_lock = threading.Lock()
+_stats = {}
+_stats_lock = threading.Lock()
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+class HostUnavailableError(Exception):
+    """Raised when a host is throttling us, down or failing and calls should be retried later."""
+
+    def __init__(self, host, retry_in, reason=None):
+        message = f"{host} unavailable, retry in {retry_in:.0f}s"
+        super().__init__(f"{message} ({reason})" if reason else message)
+        self.host = host
+        self.retry_in = retry_in
+
+
+class HostLimiter:
+    """Adaptive token bucket and circuit breaker for one host."""
+
+    def __init__(self, host, rate=None):
+        """Initialize the limiter.
+
+        Args:
+            host: Host name
+            rate: Sustainable requests per second (None disables rate limiting)
+        """
+        self.host = host
+        self.max_rate = rate
+        self.rate = rate
+        self.tokens = max(1.0, rate) if rate else 0.0
+        self.updated = time.monotonic()
+        self.failures = 0
+        self.open_until = 0.0
+        self.half_open = False
+        self.cooldown = BREAKER_COOLDOWN
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Wait for a request slot.
+
+        Raises:
+            HostUnavailableError: If the circuit is open
+        """
+        with self.lock:
+            now = time.monotonic()
+            if now < self.open_until:
+                raise HostUnavailableError(self.host, self.open_until - now)
+            if not self.rate:
+                return
+            self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Reserve a token, possibly going into debt, and sleep off the debt outside the lock
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+
+    def throttled(self, retry_after=None):
+        """Halve the request rate, pausing for retry_after seconds if given."""
+        with self.lock:
+            if not self.max_rate:
+                return
+            self.rate = max(self.max_rate * MIN_RATE_FRACTION, self.rate / 2)
+            if retry_after:
+                self.tokens = min(self.tokens, -retry_after * self.rate)
+            print(f"[HTTP] {self.host} throttled, slowing down to {self.rate:.2f} req/s", file=sys.stderr)
+
+    def succeeded(self):
+        """Close the circuit and speed back up towards the configured rate."""
+        with self.lock:
+            self.failures = 0
+            self.half_open = False
+            self.cooldown = BREAKER_COOLDOWN
+            if self.max_rate and self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * RATE_RECOVERY_STEP)
+
+    def failed(self):
+        """Count a failure, opening the circuit after too many in a row."""
+        with self.lock:
+            self.failures += 1
+            # A failure right after the circuit re-closes opens it again at once
+            if self.half_open or self.failures >= BREAKER_THRESHOLD:
+                self.open_until = time.monotonic() + self.cooldown
+                print(f"[HTTP] {self.host} unavailable, pausing requests for {self.cooldown}s", file=sys.stderr)
+                self.cooldown = min(self.cooldown * 2, BREAKER_MAX_COOLDOWN)
+                self.failures = 0
+                self.half_open = True
+
+    def retry_in(self):
+        """Return seconds until the circuit closes (0 if it is closed)."""
+        with self.lock:
+            return max(0.0, self.open_until - time.monotonic())
+
+
+def get_limiter(host):
+    """Return the limiter of a host, creating it on first use."""
+    with _limiters_lock:
+        limiter = _limiters.get(host)
+        if limiter is None:
+            limiter = _limiters[host] = HostLimiter(host, HOST_RATE_LIMITS.get(host))
+        return limiter
+
+
+def unavailable_hosts():
+    """Return {host: seconds until retry} for hosts whose circuit is open."""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.host: limiter.retry_in() for limiter in limiters if limiter.retry_in() > 0}
+
+
+def report_throttled(url, retry_after=None):
+    """Slow a host down after a throttling signal found in a response body."""
+    get_limiter(urlsplit(url).hostname).throttled(retry_after)
+
+
+def report_failure(url):
+    """Count a failed call against a host's circuit breaker."""
+    get_limiter(urlsplit(url).hostname).failed()
+
+
+@contextmanager
+def host_guard(host):
+    """Apply a host's rate limit and circuit breaker to a call made without this client.
+
+    Rate-limit and timeout errors (by exception class name, e.g. from ddgs)
+    count as failures and are raised as HostUnavailableError.
+    """
+    limiter = get_limiter(host)
+    limiter.acquire()
+    try:
+        yield
+    except Exception as e:
+        name = type(e).__name__.lower()
+        if 'ratelimit' in name or 'timeout' in name:
+            if 'ratelimit' in name:
+                limiter.throttled()
+            limiter.failed()
+            raise HostUnavailableError(host, limiter.retry_in()) from e
+        raise
+    limiter.succeeded()
+
+
+def _make_adapter(retries, backoff):
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    return HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=POOL_CONNECTIONS_PER_HOST, max_retries=retry)
+
+
+def get_session():
+    """Return the process-wide requests session, creating it on first use."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            options = get_processing_options()
+            session = requests.Session()
+            # requests already sends "Accept-Encoding: gzip, deflate" and decodes the body
+            default_adapter = _make_adapter(options['http_retries'], 0.5)
+            session.mount('https://', default_adapter)
+            session.mount('http://', default_adapter)
+            for host, (retries, backoff) in HOST_RETRY_POLICIES.items():
+                session.mount(f"https://{host}/", _make_adapter(retries, backoff))
+            _session = session
+        return _session
+
+
+def request(method, url, **kwargs):
+    """Send a request through the shared session and the host's rate limiter.
+
+    Args:
+        method: HTTP method
+        url: Request URL
+        **kwargs: Passed to requests (timeout defaults to the configured
+            connect/read timeouts)
+
+    Returns:
+        requests.Response
+
+    Raises:
+        HostUnavailableError: If the host's circuit is open, it keeps
+            throttling us, or the request still fails with a connection
+            error, timeout or server error after retries, so the caller
+            retries later instead of taking it as a missing result
+    """
+    if kwargs.get('timeout') is None:
+        options = get_processing_options()
+        kwargs['timeout'] = (options['http_connect_timeout'], options['http_read_timeout'])
+    host = urlsplit(url).netloc
+    limiter = get_limiter(urlsplit(url).hostname)
+    for attempt in range(THROTTLE_RETRIES + 1):
+        limiter.acquire()
+        start = time.monotonic()
+        try:
+            response = get_session().request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            _record(host, time.monotonic() - start, error=True)
+            limiter.failed()
+            raise HostUnavailableError(host, limiter.retry_in(), type(e).__name__) from e
+        _record(host, time.monotonic() - start, error=response.status_code >= 400)
+        if response.status_code != 429:
+            break
+        limiter.throttled(_retry_after(response))
+    else:
+        limiter.failed()
+        raise HostUnavailableError(host, limiter.retry_in())
+    if response.status_code >= 500:
+        limiter.failed()
+        raise HostUnavailableError(host, limiter.retry_in(), f"HTTP {response.status_code}")
+    limiter.succeeded()
+    return response
+
+
+def _retry_after(response):
+    try:
+        return float(response.headers.get('Retry-After', ''))
+    except ValueError:
+        return None
+
+
+def get(url, **kwargs):
+    """Send a GET request through the shared session (see request())."""
+    return request('GET', url, **kwargs)
+
+
+def post(url, **kwargs):
+    """Send a POST request through the shared session (see request())."""
+    return request('POST', url, **kwargs)
+
+
+def _record(host, elapsed, error=False):
+    with _stats_lock:
+        entry = _stats.setdefault(host, {'requests': 0, 'errors': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+        entry['requests'] += 1
+        entry['errors'] += int(error)
+        entry['seconds'] += elapsed
+        entry['max_seconds'] = max(entry['max_seconds'], elapsed)
+
+
+def _pool_counters():
+    """Return {host: (connections opened, requests sent)} from the live pools."""
+    counters = {}
+    if _session is None:
+        return counters
+    for adapter in set(_session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            opened, sent = counters.get(pool.host, (0, 0))
+            counters[pool.host] = (opened + pool.num_connections, sent + pool.num_requests)
+    return counters
+
+
+def get_http_stats():
+    """Return per-host request counts, errors, latency and connection reuses.
+
+    Returns:
+        Dictionary {host: {'requests', 'errors', 'seconds', 'max_seconds',
+        'connections', 'reuses'}}; requests include retries in 'connections'
+        and 'reuses' only
+    """
+    counters = _pool_counters()
+    with _stats_lock:
+        stats = {host: dict(entry) for host, entry in _stats.items()}
+    for host, entry in stats.items():
+        opened, sent = counters.get(host.split(':')[0], (0, 0))
+        entry['connections'] = opened
+        entry['reuses'] = max(0, sent - opened)
+    return stats
+
+
+def print_http_stats():
+    """Print one summary line per contacted host."""
+    for host, entry in sorted(get_http_stats().items()):
+        average = entry['seconds'] / entry['requests'] * 1000
+        print(f"  │   {host}: {entry['requests']} requests ({entry['errors']} errors), "
+              f"{entry['connections']} connections / {entry['reuses']} reused, "
+              f"avg {average:.0f} ms, max {entry['max_seconds'] * 1000:.0f} ms", file=sys.stderr)
@@ -1,14 +1,83 @@
 """
 Lyrics operations using lrclib.net API.
-Fetches synchronized lyrics for tracks.
+Fetches synchronized lyrics for tracks, from a local lrclib database dump
+when one is configured and from the online API otherwise.
 """
 
+import os
 import sys
-import requests
+import sqlite3
+import threading
+import unicodedata
+from . import http_client
+from .config import get_processing_options
+from .response_cache import cache_get, cache_set
+
+# Maximum duration difference in seconds for a local lrclib or search match
+LOCAL_DURATION_TOLERANCE = 2
+# Width in seconds of the duration buckets in lyrics cache keys
+LYRICS_DURATION_BUCKET = 5
+
+_local_db = None
+_local_db_lock = threading.Lock()
+
+
+def _prepare_input(text):
+    """Normalize text the way lrclib fills its *_lower columns."""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(text.lower().split())
+
+
+def _get_local_db(path):
+    """Open the lrclib dump read-only, once per process."""
+    global _local_db
+    if _local_db is None:
+        _local_db = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        indexed = set()
+        for index in _local_db.execute("PRAGMA index_list(tracks)").fetchall():
+            columns = _local_db.execute(f"PRAGMA index_info('{index[1]}')").fetchall()
+            if columns:
+                indexed.add(columns[0][2])
+        if 'name_lower' not in indexed:
+            print(f"lrclib dump {path} has no index on tracks.name_lower, local lookups will be slow",
+                  file=sys.stderr)
+    return _local_db
+
+
+def search_local_lrclib_lyrics(db_path, artist, title, album=None, duration=None):
+    """Look up synchronized lyrics in a local lrclib SQLite dump.
+    
+    Args:
+        db_path: Path to the lrclib database dump
+        artist: Artist name
+        title: Track title
+        album: Album name (optional, preferred when several tracks match)
+        duration: Track duration in seconds (optional)
+        
+    Returns:
+        Tuple (found, synced lyrics or None); found is False when the dump
+        has no such track
+    """
+    query = """SELECT l.synced_lyrics
+               FROM tracks t LEFT JOIN lyrics l ON l.id = t.last_lyrics_id
+               WHERE t.name_lower = ? AND t.artist_name_lower = ?"""
+    params = [_prepare_input(title), _prepare_input(artist)]
+    if duration:
+        query += " AND t.duration BETWEEN ? AND ?"
+        params += [duration - LOCAL_DURATION_TOLERANCE, duration + LOCAL_DURATION_TOLERANCE]
+    # Prefer the same album, then tracks with synced lyrics, then the closest duration
+    query += " ORDER BY t.album_name_lower = ? DESC, l.synced_lyrics IS NOT NULL DESC, ABS(t.duration - ?) LIMIT 1"
+    params += [_prepare_input(album), duration or 0]
+    with _local_db_lock:
+        row = _get_local_db(db_path).execute(query, params).fetchone()
+    if row is None:
+        return False, None
+    return True, row[0] or None
 
 
 def search_lrclib_lyrics(artist, title, album=None, duration=None):
-    """Search for synchronized lyrics on lrclib.net.
+    """Search for synchronized lyrics: local lrclib dump, then cache, then lrclib.net.
     
     Args:
         artist: Artist name
@@ -18,33 +87,100 @@ def search_lrclib_lyrics(artist, title, album=None, duration=None):
         
     Returns:
         Synchronized lyrics string, or None if not found
-    """
-    try:
-        params = {
-            'artist_name': artist,
-            'track_name': title,
-        }
-        if album:
-            params['album_name'] = album
-        if duration:
-            params['duration'] = duration
-        
-        url = "https://lrclib.net/api/get"
-        print(f"Searching lrclib for lyrics: {artist} - {title}", file=sys.stderr)
-        response = requests.get(url, params=params, timeout=30)
         
-        if response.status_code == 200:
-            data = response.json()
-            synced_lyrics = data.get('syncedLyrics')
-            if synced_lyrics:
-                print(f"Found synced lyrics on lrclib", file=sys.stderr)
+    Raises:
+        HostUnavailableError: If lrclib.net is unavailable
+    """
+    options = get_processing_options()
+    db_path = options['lrclib_db_path']
+    if db_path and os.path.exists(db_path):
+        try:
+            found, synced_lyrics = search_local_lrclib_lyrics(db_path, artist, title, album, duration)
+            if found:
+                if synced_lyrics:
+                    print("Found synced lyrics in local lrclib dump", file=sys.stderr)
+                else:
+                    print("Local lrclib dump has the track but no synced lyrics", file=sys.stderr)
                 return synced_lyrics
-            else:
-                print(f"lrclib found the track but no synced lyrics available", file=sys.stderr)
-        elif response.status_code == 404:
-            print(f"Track not found on lrclib (404)", file=sys.stderr)
-        else:
-            print(f"lrclib returned status {response.status_code}", file=sys.stderr)
+            print("Track not in local lrclib dump, asking lrclib.net", file=sys.stderr)
+        except sqlite3.Error as e:
+            print(f"Error reading local lrclib dump: {e}", file=sys.stderr)
+    
+    cache_key = _cache_key(artist, title, album, duration)
+    if options['lyrics_cache_ttl'] > 0:
+        hit, synced_lyrics = cache_get(cache_key)
+        if hit:
+            print(f"Lyrics cache hit ({'lyrics' if synced_lyrics else 'no lyrics'}): {artist} - {title}",
+                  file=sys.stderr)
+            return synced_lyrics
+    
+    try:
+        definitive, synced_lyrics = _fetch_online_lyrics(artist, title, album, duration)
+    except http_client.HostUnavailableError:
+        raise
     except Exception as e:
         print(f"Error searching lrclib: {e}", file=sys.stderr)
-    return None
+        return None
+    # Only definitive answers are cached, never errors
+    if definitive and options['lyrics_cache_ttl'] > 0:
+        ttl = options['lyrics_cache_ttl'] if synced_lyrics else options['lyrics_cache_negative_ttl']
+        cache_set(cache_key, synced_lyrics, ttl, options['response_cache_max_entries'])
+    return synced_lyrics
+
+
+def _cache_key(artist, title, album, duration):
+    bucket = int(duration) // LYRICS_DURATION_BUCKET if duration else ''
+    return f"lrclib:{_prepare_input(artist)}|{_prepare_input(title)}|{_prepare_input(album)}|{bucket}"
+
+
+def _fetch_online_lyrics(artist, title, album=None, duration=None):
+    """Ask lrclib.net with /api/get, then a single /api/search on a miss.
+    
+    Returns:
+        Tuple (definitive, synced lyrics or None); definitive is False when
+        lrclib answered with an error
+    """
+    params = {
+        'artist_name': artist,
+        'track_name': title,
+    }
+    if album:
+        params['album_name'] = album
+    if duration:
+        params['duration'] = duration
+    
+    url = "https://lrclib.net/api/get"
+    print(f"Searching lrclib for lyrics: {artist} - {title}", file=sys.stderr)
+    response = http_client.get(url, params=params)
+    
+    if response.status_code == 200:
+        data = response.json()
+        synced_lyrics = data.get('syncedLyrics')
+        if synced_lyrics:
+            print(f"Found synced lyrics on lrclib", file=sys.stderr)
+            return True, synced_lyrics
+        print(f"lrclib found the track but no synced lyrics available", file=sys.stderr)
+    elif response.status_code == 404:
+        print(f"Track not found on lrclib (404)", file=sys.stderr)
+    else:
+        print(f"lrclib returned status {response.status_code}", file=sys.stderr)
+        return False, None
+    
+    # /api/get needs an exact match: search once and pick the best candidate
+    search_params = {'artist_name': artist, 'track_name': title}
+    response = http_client.get("https://lrclib.net/api/search", params=search_params)
+    if response.status_code != 200:
+        print(f"lrclib search returned status {response.status_code}", file=sys.stderr)
+        return False, None
+    candidates = [c for c in response.json() if c.get('syncedLyrics')]
+    if duration:
+        candidates = [c for c in candidates
+                      if abs((c.get('duration') or 0) - duration) <= LOCAL_DURATION_TOLERANCE]
+    if not candidates:
+        print("No synced lyrics in lrclib search results", file=sys.stderr)
+        return True, None
+    wanted_album = _prepare_input(album)
+    candidates.sort(key=lambda c: (_prepare_input(c.get('albumName')) != wanted_album,
+                                   abs((c.get('duration') or 0) - (duration or 0))))
+    print("Found synced lyrics with lrclib search", file=sys.stderr)
+    return True, candidates[0]['syncedLyrics']
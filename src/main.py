@@ -7,12 +7,66 @@ import os
 import sys
 import time
 from watchdog.observers import Observer
-from .database import init_db
-from .processor import process_mp3_file
+from .config import get_processing_options
+from .database import init_db, flush_db
+from .mp3_tags import get_tag_save_stats
+from .processor import process_mp3_file, wait_for_pending_analyses, retry_deferred_files
 from .file_utils import is_in_hidden_folder, is_duplicate_and_remove
 from .watcher import MP3Handler
 
 
+# Seconds between two attempts at files deferred while a service was unavailable
+DEFERRED_RETRY_INTERVAL = 30
+
+# Optional dependencies worth tracking in the startup report
+HEAVY_MODULES = ('requests', 'ddgs', 'curl_cffi', 'numpy', 'essentia')
+
+
+def _process_uptime():
+    """Return seconds since the process started (Linux), or None."""
+    try:
+        with open('/proc/self/stat') as f:
+            # Fields after the command name, which may contain spaces
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return uptime - int(fields[19]) / os.sysconf('SC_CLK_TCK')
+    except Exception:
+        return None
+
+
+def _process_rss_mb():
+    """Return (current RSS, peak RSS) of this process in MB."""
+    current = peak = None
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    current = int(line.split()[1]) / 1024
+                elif line.startswith('VmHWM:'):
+                    peak = int(line.split()[1]) / 1024
+    except Exception:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return current, peak
+
+
+def report_startup():
+    """Print startup time, memory use and which heavy modules got loaded."""
+    uptime = _process_uptime()
+    current, peak = _process_rss_mb()
+    loaded = [name for name in HEAVY_MODULES if name in sys.modules]
+    parts = []
+    if uptime is not None:
+        parts.append(f"{uptime:.2f}s since process start")
+    if current is not None:
+        parts.append(f"RSS {current:.0f} MB")
+    if peak is not None:
+        parts.append(f"peak {peak:.0f} MB")
+    parts.append(f"loaded: {', '.join(loaded) if loaded else 'none'}")
+    print(f"Startup: {', '.join(parts)}", file=sys.stderr)
+
+
 def main(folder):
     """Main function for batch processing and monitoring MP3 files.
     
@@ -23,11 +77,23 @@ def main(folder):
         folder: Path to the folder to monitor
     """
     init_db()
+    options = get_processing_options()
+    
+    # Load Essentia models once before the scan instead of on the first file
+    # (worker processes load their own copy when they start)
+    essentia_workers = 0
+    if options['analyze_essentia']:
+        from .essentia_pool import resolve_worker_count
+        essentia_workers = resolve_worker_count(options['essentia_workers'], options['essentia_worker_threads'])
+        if essentia_workers == 0:
+            from .essentia_analysis import warmup_essentia_models
+            warmup_essentia_models()
     
     # Initialize statistics
     stats = {
         'total_files': 0,
         'isrc_match': 0,
+        'album_match': 0,
         'no_isrc_in_mp3': 0,
         'no_matching_isrc': 0,
         'no_deezer_results': 0,
@@ -37,9 +103,13 @@ def main(folder):
         'duplicates_removed': 0,
         'artwork_fetched': 0,
         'gain_fixed': 0,
-        'essentia_analyzed': 0
+        'essentia_analyzed': 0,
+        'deferred': 0,
+        'tag_write_failed': 0
     }
     
+    report_startup()
+    
     # Initial scan of all MP3 files
     print("Starting initial scan...", file=sys.stderr)
     # Récupère la liste de tous les fichiers MP3 à traiter
@@ -71,6 +141,10 @@ def main(folder):
         print(f"{idx}/{total} : {os.path.basename(path)}", file=sys.stderr)
         process_mp3_file(path, stats)
     
+    # Let queued Essentia batches finish before reporting
+    wait_for_pending_analyses()
+    flush_db()
+    
     # Display processing summary
     print("\n" + "-"*80, file=sys.stderr)
     print("PROCESSING SUMMARY", file=sys.stderr)
@@ -78,12 +152,36 @@ def main(folder):
     print(f"MP3 files analyzed: {stats['total_files']}", file=sys.stderr)
     if stats['isrc_match'] > 0:
         print(f"  ├─ ✓ Tags updated (ISRC found in Deezer): {stats['isrc_match']}", file=sys.stderr)
+    if stats['album_match'] > 0:
+        print(f"  ├─ ✓ Tags updated (matched in Deezer album): {stats['album_match']}", file=sys.stderr)
     if stats['artwork_fetched'] > 0:
         print(f"  ├─ ✓ Artworks generated (cover.webp): {stats['artwork_fetched']}", file=sys.stderr)
     if stats['gain_fixed'] > 0:
         print(f"  ├─ ✓ Gain normalized (loudgain): {stats['gain_fixed']}", file=sys.stderr)
     if stats['essentia_analyzed'] > 0:
         print(f"  ├─ ✓ Essentia analysis generated: {stats['essentia_analyzed']}", file=sys.stderr)
+        if essentia_workers:
+            from .essentia_pool import get_essentia_pool_timings as get_essentia_timings
+        else:
+            from .essentia_analysis import get_essentia_timings
+        timings = get_essentia_timings()
+        print(f"  │   (model load: {timings['load_seconds']:.2f}s once, "
+              f"inference: {timings['inference_seconds']:.2f}s over {timings['files']} files)", file=sys.stderr)
+    tag_saves = get_tag_save_stats()
+    if tag_saves['in_place'] or tag_saves['rewrites']:
+        print(f"  ├─ Tag saves: {tag_saves['in_place']} in place, {tag_saves['rewrites']} full rewrites",
+              file=sys.stderr)
+    # Only report HTTP traffic if a stage actually loaded the client
+    http_client = sys.modules.get(f"{__package__}.http_client")
+    if http_client and http_client.get_http_stats():
+        print("  ├─ HTTP requests per host:", file=sys.stderr)
+        http_client.print_http_stats()
+    response_cache = sys.modules.get(f"{__package__}.response_cache")
+    if response_cache:
+        cache_stats = response_cache.get_cache_stats()
+        if cache_stats['hits'] or cache_stats['misses']:
+            print(f"  ├─ Response cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+                  f"{cache_stats['evictions']} evicted", file=sys.stderr)
     if stats['no_isrc_in_mp3'] > 0:
         print(f"  ├─ ✗ No ISRC in MP3: {stats['no_isrc_in_mp3']}", file=sys.stderr)
     if stats['no_matching_isrc'] > 0:
@@ -96,6 +194,10 @@ def main(folder):
         print(f"  ├─ Already processed (skipped): {stats['already_processed']}", file=sys.stderr)
     if stats['hidden_folders'] > 0:
         print(f"  ├─ Ignored files (hidden folder): {stats['hidden_folders']}", file=sys.stderr)
+    if stats['tag_write_failed'] > 0:
+        print(f"  ├─ ✗ Tags could not be written (retried on the next scan): {stats['tag_write_failed']}", file=sys.stderr)
+    if stats['deferred'] > 0:
+        print(f"  ├─ Deferred (service unavailable, retried later): {stats['deferred']}", file=sys.stderr)
     if stats['duplicates_removed'] > 0:
         print(f"  └─ Duplicates removed: {stats['duplicates_removed']}", file=sys.stderr)
     print("-"*80 + "\n", file=sys.stderr)
@@ -109,8 +211,13 @@ def main(folder):
     observer.start()
     
     try:
+        last_retry = time.monotonic()
         while True:
             time.sleep(1)
+            # Pick deferred files back up once their services are reachable again
+            if time.monotonic() - last_retry >= DEFERRED_RETRY_INTERVAL:
+                retry_deferred_files(stats)
+                last_retry = time.monotonic()
     except KeyboardInterrupt:
         observer.stop()
     observer.join()
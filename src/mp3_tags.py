@@ -3,11 +3,47 @@ MP3 tag operations using mutagen.
 Handles reading and writing ID3 tags.
 """
 
+import os
 import sys
 import re
+import hashlib
+import threading
+from contextlib import contextmanager
 from mutagen.easyid3 import EasyID3
 from mutagen.id3 import ID3NoHeaderError, ID3, TXXX, USLT, TMOO, TBPM, TKEY
 from mutagen.mp3 import MP3
+from .config import get_processing_options
+
+_save_stats = {'in_place': 0, 'rewrites': 0}
+_save_stats_lock = threading.Lock()
+
+
+def id3_padding(info):
+    """mutagen padding callback that keeps tag writes in place when possible.
+    
+    A tag that still fits in the space of the old one keeps that space, so the
+    audio data does not move. A tag that outgrows it gets ID3_PADDING bytes of
+    padding, enough for the frames added by later steps (lyrics, gain, moods)
+    to be written in place.
+    
+    Args:
+        info: mutagen PaddingInfo (padding left after the new tag, file size)
+        
+    Returns:
+        Padding in bytes to write after the tag
+    """
+    in_place = info.padding >= 0
+    with _save_stats_lock:
+        _save_stats['in_place' if in_place else 'rewrites'] += 1
+    if in_place:
+        return info.padding
+    return get_processing_options()['id3_padding']
+
+
+def get_tag_save_stats():
+    """Return how many tag saves were done in place versus as full rewrites."""
+    with _save_stats_lock:
+        return dict(_save_stats)
 
 
 def extract_isrc_from_comment(comment):
@@ -47,61 +83,117 @@ def get_mp3_tags(file_path):
     Returns:
         Tuple of (tags dict, artist, album, title)
     """
-    try:
-        audio = EasyID3(file_path)
-        tags = dict(audio)
-        artist = tags.get('artist', [''])[0]
-        album = tags.get('album', [''])[0]
-        title = tags.get('title', [''])[0]
+    return Mp3File(file_path).read_tags()
+
+
+class Mp3File:
+    """Parsed MP3 file shared by every processing stage.
+    
+    The ID3 tag and MPEG stream info are read once. Tag writes go through
+    session(), which edits and saves that same parsed tag, so the snapshot
+    stays valid after our own writes; call reload() after an external tool
+    (e.g. loudgain) changed the file.
+    """
+    
+    def __init__(self, file_path):
+        """Parse the file.
         
-        # If no ISRC in standard field, try to extract from comment and save it
-        isrc = tags.get('isrc', [''])[0] if isinstance(tags.get('isrc'), list) else tags.get('isrc', '')
-        if not isrc:
-            # Try EasyID3 comment field
-            comment = tags.get('comment', [''])[0] if isinstance(tags.get('comment'), list) else tags.get('comment', '')
+        Args:
+            file_path: Path to the MP3 file
+        """
+        self.file_path = file_path
+        self.reload()
+    
+    def reload(self):
+        """Parse the ID3 tag and MPEG info again from disk."""
+        try:
+            audio = MP3(self.file_path)
+            self.info = audio.info
+            self.id3 = audio.tags if audio.tags is not None else ID3()
+        except Exception as e:
+            print(f"Error reading MPEG info: {e}", file=sys.stderr)
+            self.info = None
+            try:
+                self.id3 = ID3(self.file_path)
+            except Exception:
+                self.id3 = ID3()
+    
+    @property
+    def duration(self):
+        """Audio duration in seconds as int, or None if unknown."""
+        return int(self.info.length) if self.info else None
+    
+    def tags(self):
+        """Return the tag as a dict of EasyID3 keys to lists of strings."""
+        tags = {}
+        for key, getter in EasyID3.Get.items():
+            try:
+                tags[key] = list(getter(self.id3, key))
+            except KeyError:
+                pass
+        return tags
+    
+    @contextmanager
+    def session(self):
+        """Open a TagSession on the parsed tag, saved once when the block exits.
+        
+        If the block raises or the save fails (session.failed), the snapshot
+        is reloaded to drop the staged changes.
+        """
+        session = TagSession(self.file_path, id3=self.id3)
+        try:
+            yield session
+        except BaseException:
+            self.reload()
+            raise
+        if not session.commit():
+            self.reload()
+    
+    def read_tags(self):
+        """Return the tags, moving an ISRC found in a comment to the ISRC tag.
+        
+        Returns:
+            Tuple of (tags dict, artist, album, title)
+        """
+        try:
+            tags = self.tags()
+            artist = tags.get('artist', [''])[0]
+            album = tags.get('album', [''])[0]
+            title = tags.get('title', [''])[0]
             
-            # Also check ID3 COMM frames directly for comments
-            if not comment:
-                try:
-                    id3 = ID3(file_path)
-                    for frame in id3.getall('COMM'):
+            # If no ISRC in standard field, try to extract from comment and save it
+            isrc = tags.get('isrc', [''])[0] if isinstance(tags.get('isrc'), list) else tags.get('isrc', '')
+            if not isrc:
+                # Try EasyID3 comment field
+                comment = tags.get('comment', [''])[0] if isinstance(tags.get('comment'), list) else tags.get('comment', '')
+                
+                # Also check ID3 COMM frames directly for comments
+                if not comment:
+                    for frame in self.id3.getall('COMM'):
                         if frame.text and frame.text[0]:
                             comment = frame.text[0]
                             break
-                except:
-                    pass
-            
-            if comment:
-                print(f"No ISRC tag, checking comment field: '{comment}'", file=sys.stderr)
-            extracted_isrc = extract_isrc_from_comment(comment)
-            if extracted_isrc:
-                print(f"ISRC extracted from comment: {extracted_isrc} - Writing to ISRC tag and removing all comments", file=sys.stderr)
-                
-                # Use ID3 directly to remove all comment frames and write ISRC
-                try:
-                    id3 = ID3(file_path)
-                    # Remove all comment frames (ID3v2)
-                    id3.delall('COMM')
-                    # Save and remove ID3v1 tag entirely (v1=2 removes ID3v1)
-                    id3.save(v1=2)
-                except:
-                    pass
                 
-                # Write ISRC using EasyID3 and remove comment field
-                audio['isrc'] = extracted_isrc
-                # Remove comment from EasyID3 if present
-                if 'comment' in audio:
-                    del audio['comment']
-                audio.save()
-                
-                tags['isrc'] = [extracted_isrc]
-            elif comment:
-                print(f"Comment exists but no ISRC pattern found", file=sys.stderr)
-        
-        return tags, artist, album, title
-    except Exception as e:
-        print(f"Error reading tags: {e}", file=sys.stderr)
-        return {}, '', '', ''
+                if comment:
+                    print(f"No ISRC tag, checking comment field: '{comment}'", file=sys.stderr)
+                extracted_isrc = extract_isrc_from_comment(comment)
+                if extracted_isrc:
+                    print(f"ISRC extracted from comment: {extracted_isrc} - Writing to ISRC tag and removing all comments", file=sys.stderr)
+                    
+                    with self.session() as session:
+                        # Remove all comment frames (ID3v2) and the ID3v1 tag entirely
+                        session.id3.delall('COMM')
+                        session.v1 = 2
+                        session.set('isrc', extracted_isrc)
+                    
+                    tags['isrc'] = [extracted_isrc]
+                elif comment:
+                    print(f"Comment exists but no ISRC pattern found", file=sys.stderr)
+            
+            return tags, artist, album, title
+        except Exception as e:
+            print(f"Error reading tags: {e}", file=sys.stderr)
+            return {}, '', '', ''
 
 
 def check_tags(tags):
@@ -119,38 +211,98 @@ def check_tags(tags):
     return artist, album, title, bool(artist and title)
 
 
-def set_mp3_tag(file_path, tag, value):
-    """Set a tag in an MP3 file using mutagen.
+class TagSession:
+    """Collect tag changes for one MP3 file and write them with a single save.
     
-    Handles special cases for gain (replaygain) and lyrics (USLT frame).
+    The ID3 tag is parsed once; every set() edits it in memory and the file is
+    saved once when the session is committed (on leaving a with block without
+    an exception). Keys are the EasyID3 keys plus 'gain', 'lyrics', 'mood',
+    'bpm', 'initialkey' and 'txxx:<desc>'.
     
-    Args:
-        file_path: Path to the MP3 file
-        tag: Tag name to set
-        value: Value to set for the tag
+    Read and save errors are reported, not raised: check `failed` after the
+    with block to know whether the changes reached the file.
+    
+    Usage:
+        with TagSession(file_path) as session:
+            session.set('album', 'Album')
+            session.set('lyrics', lyrics)
+        if session.failed:
+            ...
     """
-    try:
+    
+    def __init__(self, file_path, id3=None):
+        """Parse the file's ID3 tag (an empty one if the file has none).
+        
+        Args:
+            file_path: Path to the MP3 file
+            id3: Already parsed ID3 tag of the file to edit instead
+        """
+        self.file_path = file_path
+        self.failed = False
+        if id3 is not None:
+            self.id3 = id3
+        else:
+            try:
+                self.id3 = ID3(file_path)
+            except ID3NoHeaderError:
+                self.id3 = ID3()
+            except Exception as e:
+                # Never save over a tag that could not be read
+                print(f"Error reading tags from {file_path}: {e}", file=sys.stderr)
+                self.id3 = ID3()
+                self.failed = True
+        self.changed = False
+        # ID3v1 handling on save (1 updates an existing v1 tag, 2 removes it)
+        self.v1 = 1
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.commit()
+        return False
+    
+    def get(self, tag):
+        """Return the current values of a tag as a list of strings.
+        
+        Args:
+            tag: EasyID3 key, or 'lyrics' for USLT frames
+        """
+        if tag == 'lyrics':
+            return [frame.text for frame in self.id3.getall('USLT')]
         try:
-            audio = EasyID3(file_path)
-        except ID3NoHeaderError:
-            audio = EasyID3()
-            audio.save(file_path)
-            audio = EasyID3(file_path)
+            return list(EasyID3.Get[tag](self.id3, tag))
+        except KeyError:
+            return []
+    
+    def set(self, tag, value):
+        """Stage a tag change; errors are reported and do not stop the session.
         
+        Handles special cases for gain (replaygain) and lyrics (USLT frame).
+        
+        Args:
+            tag: Tag name to set
+            value: Value to set for the tag
+        """
+        try:
+            self._set(tag, value)
+            self.changed = True
+        except Exception as e:
+            print(f"Error in set_mp3_tag on {self.file_path}: {e}", file=sys.stderr)
+    
+    def _set(self, tag, value):
+        id3 = self.id3
         if tag == 'gain':
             # Use TXXX:replaygain_track_gain frame
-            id3 = ID3(file_path)
             id3.delall('TXXX:replaygain_track_gain')
             id3.add(TXXX(encoding=3, desc='replaygain_track_gain', text=str(value)))
-            id3.save(file_path)
-            print(f"Tag 'replaygain_track_gain' updated in {file_path}: {value}")
+            print(f"Tag 'replaygain_track_gain' updated in {self.file_path}: {value}")
         elif tag == 'lyrics':
             # Use USLT frame for synced lyrics
-            id3 = ID3(file_path)
             id3.delall('USLT')
             id3.add(USLT(encoding=3, lang='eng', desc='', text=value))
-            id3.save(file_path)
-            print(f"Synced lyrics added to {file_path}")
+            print(f"Synced lyrics added to {self.file_path}")
         elif tag == 'mood':
             # Deduplicate moods before writing
             if isinstance(value, list):
@@ -160,32 +312,23 @@ def set_mp3_tag(file_path, tag, value):
             seen = set()
             unique_items = [x for x in items if not (x in seen or seen.add(x))]
             mood_str = "; ".join(unique_items)
-            id3 = ID3(file_path)
             id3.delall('TMOO')
             id3.add(TMOO(encoding=3, text=[mood_str]))
             id3.delall('TXXX:MOOD')
-            # id3.add(TXXX(encoding=3, desc='MOOD', text=mood_str))
-            id3.save(file_path)
-            print(f"Tag 'mood' updated in {file_path}: {mood_str}")
+            print(f"Tag 'mood' updated in {self.file_path}: {mood_str}")
         elif tag == 'bpm':
-            id3 = ID3(file_path)
             id3.delall('TBPM')
             id3.add(TBPM(encoding=3, text=[str(value)]))
-            id3.save(file_path)
-            print(f"Tag 'bpm' updated in {file_path}: {value}")
+            print(f"Tag 'bpm' updated in {self.file_path}: {value}")
         elif tag == 'initialkey':
-            id3 = ID3(file_path)
             id3.delall('TKEY')
             id3.add(TKEY(encoding=3, text=[str(value)]))
-            id3.save(file_path)
-            print(f"Tag 'initialkey' updated in {file_path}: {value}")
+            print(f"Tag 'initialkey' updated in {self.file_path}: {value}")
         elif tag.startswith('txxx:'):
             desc = tag.split(':', 1)[1]
-            id3 = ID3(file_path)
             id3.delall(f'TXXX:{desc}')
             id3.add(TXXX(encoding=3, desc=desc, text=str(value)))
-            id3.save(file_path)
-            print(f"Tag 'TXXX:{desc}' updated in {file_path}: {value}")
+            print(f"Tag 'TXXX:{desc}' updated in {self.file_path}: {value}")
         else:
             # For other tags, handle lists and convert to string
             if isinstance(value, list):
@@ -193,19 +336,50 @@ def set_mp3_tag(file_path, tag, value):
             else:
                 value_str = str(value)
             # For tags that can have multiple values (artist, genre, mood, etc.)
-            if tag == "genre":
-                # For genre, clear existing value before writing new one
-                if tag in audio:
-                    del audio[tag]
-                audio[tag] = [value_str]
-            elif tag in ["artist", "albumartist", "mood", "composer", "lyricist"]:
+            if tag in ["artist", "albumartist", "composer", "lyricist"]:
                 items = [v.strip() for v in re.split(r"[;,]", value_str) if v.strip()]
                 unique_sorted = sorted(set(items), key=str.lower)
-                audio[tag] = ["; ".join(unique_sorted)]
-            else:
-                audio[tag] = [value_str]
-            audio.save()
-            print(f"Tag '{tag}' updated in {file_path}: {value_str}")
+                value_str = "; ".join(unique_sorted)
+            # EasyID3 key → frame mapping, applied to the already parsed tag
+            setter = EasyID3.Set.get(tag)
+            if setter is None:
+                raise KeyError(f"{tag!r} is not a valid key")
+            setter(id3, tag, [value_str])
+            print(f"Tag '{tag}' updated in {self.file_path}: {value_str}")
+    
+    def commit(self):
+        """Save the staged changes in one write (no-op if nothing changed).
+        
+        Returns:
+            True if the file holds the staged changes, False if the tag could
+            not be read or saved (read-only, missing or locked file)
+        """
+        if self.failed:
+            return False
+        if self.changed:
+            try:
+                self.id3.save(self.file_path, v1=self.v1, padding=id3_padding)
+            except Exception as e:
+                print(f"Error saving tags to {self.file_path}: {e}", file=sys.stderr)
+                self.failed = True
+                return False
+            self.changed = False
+        return True
+
+
+def set_mp3_tag(file_path, tag, value):
+    """Set a single tag in an MP3 file using mutagen.
+    
+    Writing several tags at once is cheaper with a TagSession.
+    
+    Args:
+        file_path: Path to the MP3 file
+        tag: Tag name to set
+        value: Value to set for the tag
+    """
+    try:
+        with TagSession(file_path) as session:
+            session.set(tag, value)
     except Exception as e:
         print(f"Error in set_mp3_tag on {file_path}: {e}", file=sys.stderr)
 
@@ -225,3 +399,51 @@ def get_audio_duration(file_path):
     except Exception as e:
         print(f"Error getting duration: {e}", file=sys.stderr)
         return None
+
+
+def get_audio_hash(file_path):
+    """Hash the MPEG audio data of a file, ignoring its tags.
+    
+    The leading ID3v2 tag and trailing APEv2/ID3v1 tags are skipped, so
+    tag edits (including our own) do not change the hash.
+    
+    Args:
+        file_path: Path to the MP3 file
+        
+    Returns:
+        Hex digest string, or None on error
+    """
+    try:
+        size = os.path.getsize(file_path)
+        with open(file_path, 'rb') as f:
+            start = 0
+            header = f.read(10)
+            if len(header) == 10 and header[:3] == b'ID3':
+                tag_size = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+                footer = 10 if header[5] & 0x10 else 0
+                start = 10 + tag_size + footer
+            end = size
+            if end - start >= 128:
+                f.seek(end - 128)
+                if f.read(3) == b'TAG':
+                    end -= 128
+            if end - start >= 32:
+                f.seek(end - 32)
+                ape_footer = f.read(32)
+                if ape_footer[:8] == b'APETAGEX':
+                    ape_size = int.from_bytes(ape_footer[12:16], 'little')
+                    ape_header = 32 if int.from_bytes(ape_footer[20:24], 'little') & 0x80000000 else 0
+                    end -= ape_size + ape_header
+            digest = hashlib.blake2b(digest_size=16)
+            f.seek(start)
+            remaining = max(0, end - start)
+            while remaining:
+                chunk = f.read(min(1 << 20, remaining))
+                if not chunk:
+                    break
+                digest.update(chunk)
+                remaining -= len(chunk)
+        return digest.hexdigest()
+    except Exception as e:
+        print(f"Error hashing audio data: {e}", file=sys.stderr)
+        return None
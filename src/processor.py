@@ -3,16 +3,20 @@ MP3 file processor.
 Orchestrates the processing of MP3 files including tag fixing, artwork generation, and gain normalization.
 """
 
+import os
 import sys
+import threading
 from .config import get_processing_options
-from .database import is_file_processed, update_file_processing_status
-from .mp3_tags import get_mp3_tags, check_tags, set_mp3_tag, get_audio_duration
-from .artwork import fetch_video_artwork
-from .deezer_api import search_deezer_track, get_deezer_track_info
-from .lyrics import search_lrclib_lyrics
+from .database import is_file_processed, update_file_processing_status, rename_essentia_file
+from .mp3_tags import Mp3File, check_tags
 from .gain import fix_gain
-from .essentia_analysis import analyze_with_essentia
 from .audiomuse import schedule_global_rescan
+# Stage modules with heavy dependencies (requests, ddgs/curl_cffi, numpy,
+# essentia/TensorFlow) are imported when their stage first runs
+
+# Files whose processing waits for an unavailable external service
+_deferred_files = []
+_deferred_lock = threading.Lock()
 
 
 def handle_stats(stats, key):
@@ -27,15 +31,71 @@ def handle_stats(stats, key):
 
 
 def process_mp3_file(file_path, stats=None):
+    """Process a single MP3 file, deferring it while a service is unavailable.
+    
+    Files whose Deezer, lyrics or artwork stage hits a throttled, down or
+    failing service are not recorded as processed; they are queued and picked up
+    again by retry_deferred_files() once the service is back.
+    
+    Args:
+        file_path: Path to the MP3 file
+        stats: Statistics dictionary to update (optional)
+        
+    Returns:
+        Status string (see _process_mp3_file), or 'deferred'
+    """
+    try:
+        return _process_mp3_file(file_path, stats)
+    except Exception as error:
+        # The HTTP client is only loaded once a network stage has run
+        http_client = sys.modules.get(f"{__package__}.http_client")
+        if http_client is None or not isinstance(error, http_client.HostUnavailableError):
+            raise
+        print(f"{error}: deferring {file_path}\n", file=sys.stderr)
+        with _deferred_lock:
+            if file_path not in _deferred_files:
+                _deferred_files.append(file_path)
+        handle_stats(stats, 'deferred')
+        return 'deferred'
+
+
+def retry_deferred_files(stats=None):
+    """Reprocess deferred files once no external service is paused.
+    
+    Args:
+        stats: Statistics dictionary to update (optional)
+        
+    Returns:
+        Number of files still deferred
+    """
+    with _deferred_lock:
+        if not _deferred_files:
+            return 0
+        http_client = sys.modules.get(f"{__package__}.http_client")
+        if http_client and http_client.unavailable_hosts():
+            return len(_deferred_files)
+        files = list(_deferred_files)
+        _deferred_files.clear()
+    print(f"Retrying {len(files)} deferred files", file=sys.stderr)
+    for file_path in files:
+        if os.path.exists(file_path):
+            process_mp3_file(file_path, stats)
+    with _deferred_lock:
+        return len(_deferred_files)
+
+
+def _process_mp3_file(file_path, stats=None):
     """Orchestrate the processing of a single MP3 file.
     
     Processing steps:
     1. Check if already processed (early exit)
     2. Read and validate tags
     3. Optionally generate artwork from Apple Music
-    4. Search Deezer for track info
+    4. Look up the track on Deezer (folder album, then ISRC, then search)
     5. Update tags if ISRC matches
     6. Optionally apply loudgain normalization
+    7. Optionally analyze with Essentia (deferred to worker processes or batches when enabled)
+    8. Record status and optionally organize the file
     
     Args:
         file_path: Path to the MP3 file
@@ -43,7 +103,8 @@ def process_mp3_file(file_path, stats=None):
         
     Returns:
         Status string: 'already_processed', 'incomplete_tags', 'no_deezer_results',
-                      'isrc_match', 'no_isrc_in_mp3', 'no_matching_isrc', or 'fix_tags_skipped'
+                      'isrc_match', 'album_match', 'no_isrc_in_mp3', 'no_matching_isrc',
+                      'fix_tags_skipped', 'tag_write_failed' or 'essentia_upgraded'
     """
     # Step 1: Check if already processed and what needs to be done
     processed_status = is_file_processed(file_path)
@@ -55,7 +116,8 @@ def process_mp3_file(file_path, stats=None):
         'lyrics_fetched': False,
         'artwork_generated': False,
         'gain_applied': False,
-        'essentia_analyzed': False
+        'essentia_analyzed': False,
+        'essentia_sampled': False
     }
     
     # Determine what still needs processing
@@ -65,12 +127,18 @@ def process_mp3_file(file_path, stats=None):
     skip_essentia = processed_status and processed_status['essentia_analyzed']
     
     if processed_status:
+        # A full-analysis pass upgrades files that only got a sampled analysis
+        if (processed_status['essentia_sampled'] and options['analyze_essentia']
+                and options['essentia_mode'] == 'full'):
+            return _upgrade_sampled_analysis(file_path, processed_status, stats)
         handle_stats(stats, 'already_processed')
         return 'already_processed'
     
     # Step 2: Read and validate tags
     print(f"Reading tags from: {file_path}", file=sys.stderr)
-    tags = get_mp3_tags(file_path)[0]
+    # Tags and MPEG info are parsed once and shared by every step below
+    mp3 = Mp3File(file_path)
+    tags = mp3.read_tags()[0]
     artist, album, title, has_tags = check_tags(tags)
     albumartist = tags.get('albumartist', [''])[0] if 'albumartist' in tags else tags.get('artist', [''])[0]
     print(f"File: {file_path}")
@@ -82,27 +150,45 @@ def process_mp3_file(file_path, stats=None):
     
     # Step 3: Generate artwork if needed and not already done
     if not skip_artwork and options['fetch_video_artwork']:
-        artwork_result = fetch_video_artwork(artist, album, title, file_path, stats)
+        from .artwork import fetch_video_artwork
+        artwork_result = fetch_video_artwork(artist, album, title, file_path, stats, albumartist)
         if artwork_result:
             processing_done['artwork_generated'] = True
     elif processed_status:
         processing_done['artwork_generated'] = processed_status['artwork_generated']
     
-    # Step 4: Search Deezer if tags need fixing
+    # Step 4: Look up the track on Deezer if tags need fixing
     result = 'no_changes'
     if not skip_tags and options['fix_tags']:
-        track_ids = search_deezer_track(artist, album, title)
-        if not track_ids:
-            print("No Deezer results\n")
-            handle_stats(stats, 'no_deezer_results')
+        # A direct ISRC lookup costs a single request, search only without a hit
+        mp3_isrc = _get_mp3_isrc(tags)
+        found = None
+        # Without an album tag any album of the artist would match
+        if options['deezer_album_mode'] and album.strip():
+            found = _update_tags_from_album(options, tags, artist, album, title, mp3, stats)
+        if found is None and mp3_isrc:
+            found = _update_tags_from_isrc(options, mp3_isrc, artist, album, title, mp3, stats)
+        if found is not None:
+            result = found
         else:
-            # Step 5: Update tags
-            result = _update_tags_from_deezer(options, tags, artist, album, title, file_path, track_ids, stats)
-            if result == 'isrc_match':
-                processing_done['tags_fixed'] = True
-                # Check if lyrics were fetched during tag update
-                if options['fetch_lyrics']:
-                    processing_done['lyrics_fetched'] = True
+            from .deezer_api import search_deezer_track, rank_deezer_hits
+            hits = search_deezer_track(artist, album, title)
+            if not hits:
+                print("No Deezer results\n")
+                handle_stats(stats, 'no_deezer_results')
+            else:
+                # Step 5: Update tags, looking up the most likely hits first
+                track_ids, conclusive = rank_deezer_hits(hits, artist, album, title, mp3.duration)
+                result = _update_tags_from_deezer(options, tags, artist, album, title, mp3, track_ids, stats,
+                                                  conclusive)
+        if result == 'tag_write_failed':
+            # Not recorded as processed: the next scan tries the file again
+            return result
+        if result in ('isrc_match', 'album_match'):
+            processing_done['tags_fixed'] = True
+            # Check if lyrics were fetched during tag update
+            if options['fetch_lyrics']:
+                processing_done['lyrics_fetched'] = True
     elif processed_status:
         processing_done['tags_fixed'] = processed_status['tags_fixed']
         processing_done['lyrics_fetched'] = processed_status['lyrics_fetched']
@@ -112,17 +198,43 @@ def process_mp3_file(file_path, stats=None):
         gain_result = fix_gain(file_path, stats)
         if gain_result:
             processing_done['gain_applied'] = True
+            # loudgain rewrote the tags outside of the shared snapshot
+            mp3.reload()
     elif processed_status:
         processing_done['gain_applied'] = processed_status['gain_applied']
 
     # Step 7: Analyze with Essentia if enabled and not already done
     if not skip_essentia and options['analyze_essentia']:
-        essentia_result = analyze_with_essentia(file_path, stats)
-        if essentia_result:
-            processing_done['essentia_analyzed'] = True
+        # Tags are written and the file finalized once the analysis completes,
+        # which may be later when worker processes or batching are enabled
+        from .essentia_analysis import write_essentia_tags
+
+        def on_essentia_result(analysis):
+            if write_essentia_tags(file_path, analysis, stats, mp3=mp3):
+                processing_done['essentia_analyzed'] = True
+                processing_done['essentia_sampled'] = analysis.get('sampled', False)
+            _finalize_mp3_file(file_path, options, processing_done, albumartist, album, title)
+
+        _get_essentia_submitter(options)(file_path, on_essentia_result)
+        return result
     elif processed_status:
         processing_done['essentia_analyzed'] = processed_status['essentia_analyzed']
     
+    _finalize_mp3_file(file_path, options, processing_done, albumartist, album, title)
+    return result
+
+
+def _finalize_mp3_file(file_path, options, processing_done, albumartist, album, title):
+    """Record the processing status, organize the file and notify audiomuse-ai.
+    
+    Args:
+        file_path: Path to the MP3 file
+        options: Processing options dictionary
+        processing_done: Dictionary of processing steps completed in this run
+        albumartist: Album artist used for organization
+        album: Album name
+        title: Track title
+    """
     # Step 8: Organize MP3 file if enabled
     if options['organize_mp3']:
         from .file_utils import move_mp3_to_library
@@ -134,9 +246,12 @@ def process_mp3_file(file_path, stats=None):
                 lyrics_fetched=processing_done['lyrics_fetched'],
                 artwork_generated=processing_done['artwork_generated'],
                 gain_applied=processing_done['gain_applied'],
-                essentia_analyzed=processing_done['essentia_analyzed']
+                essentia_analyzed=processing_done['essentia_analyzed'],
+                essentia_sampled=processing_done['essentia_sampled']
             )
-            move_mp3_to_library(file_path, albumartist, album, title)
+            dest_path = move_mp3_to_library(file_path, albumartist, album, title)
+            if processing_done['essentia_analyzed'] and dest_path != file_path:
+                rename_essentia_file(file_path, dest_path)
             print(f"MP3 file organized: {albumartist}/{album}/{title}", file=sys.stderr)
         except Exception as e:
             print(f"Error organizing MP3 file: {e}", file=sys.stderr)
@@ -148,13 +263,75 @@ def process_mp3_file(file_path, stats=None):
             lyrics_fetched=processing_done['lyrics_fetched'],
             artwork_generated=processing_done['artwork_generated'],
             gain_applied=processing_done['gain_applied'],
-            essentia_analyzed=processing_done['essentia_analyzed']
+            essentia_analyzed=processing_done['essentia_analyzed'],
+            essentia_sampled=processing_done['essentia_sampled']
         )
     schedule_global_rescan()
-    return result
 
 
-def _update_tags_from_deezer(options, tags, artist, album, title, file_path, track_ids, stats):
+def _upgrade_sampled_analysis(file_path, processed_status, stats):
+    """Replace a sampled Essentia analysis with a full one, keeping other statuses.
+    
+    Args:
+        file_path: Path to the MP3 file
+        processed_status: Status dictionary from the database
+        stats: Statistics dictionary (optional)
+        
+    Returns:
+        Status string 'essentia_upgraded'
+    """
+    from .essentia_analysis import write_essentia_tags
+    
+    def on_essentia_result(analysis):
+        if not write_essentia_tags(file_path, analysis, stats, replace_moods=True):
+            return
+        update_file_processing_status(
+            file_path,
+            tags_fixed=processed_status['tags_fixed'],
+            lyrics_fetched=processed_status['lyrics_fetched'],
+            artwork_generated=processed_status['artwork_generated'],
+            gain_applied=processed_status['gain_applied'],
+            essentia_analyzed=True,
+            essentia_sampled=analysis.get('sampled', False)
+        )
+    
+    print(f"Upgrading sampled Essentia analysis: {file_path}", file=sys.stderr)
+    _get_essentia_submitter(get_processing_options())(file_path, on_essentia_result)
+    return 'essentia_upgraded'
+
+
+def _analyze_inline(file_path, callback):
+    """Run the Essentia analysis in the calling thread."""
+    from .essentia_analysis import run_essentia_analysis
+    callback(run_essentia_analysis(file_path))
+
+
+def _get_essentia_submitter(options):
+    """Return the submit function of the Essentia backend.
+    
+    Worker processes take precedence over in-process batching; otherwise the
+    analysis runs inline.
+    """
+    from .essentia_pool import resolve_worker_count, get_essentia_pool
+    workers = resolve_worker_count(options['essentia_workers'], options['essentia_worker_threads'])
+    if workers > 0:
+        return get_essentia_pool(workers, options['essentia_worker_threads']).submit
+    if options['essentia_batch_size'] > 0:
+        from .essentia_batch import get_essentia_batcher
+        return get_essentia_batcher(options['essentia_batch_size'], options['essentia_batch_max_wait']).submit
+    return _analyze_inline
+
+
+def wait_for_pending_analyses():
+    """Block until queued (pooled or batched) analyses have written their tags."""
+    from .essentia_pool import wait_for_essentia_pool
+    wait_for_essentia_pool()
+    if get_processing_options()['essentia_batch_size'] > 0:
+        from .essentia_batch import flush_essentia_batches
+        flush_essentia_batches()
+
+
+def _update_tags_from_deezer(options, tags, artist, album, title, mp3, track_ids, stats, conclusive=False):
     """Update MP3 tags from Deezer info if enabled and ISRC matches.
     
     Searches through Deezer track results to find an ISRC match with the MP3 file.
@@ -166,95 +343,48 @@ def _update_tags_from_deezer(options, tags, artist, album, title, file_path, tra
         artist: Artist name
         album: Album name
         title: Track title
-        file_path: Path to the MP3 file
-        track_ids: List of Deezer track IDs to check
+        mp3: Parsed MP3 file (Mp3File)
+        track_ids: List of Deezer track IDs to check, most likely first
         stats: Statistics dictionary
+        conclusive: Look up the first track alone before the others
         
     Returns:
-        Status string: 'isrc_match', 'no_isrc_in_mp3', 'no_matching_isrc', or 'fix_tags_skipped'
+        Status string: 'isrc_match', 'no_isrc_in_mp3', 'no_matching_isrc', 'tag_write_failed'
+        or 'fix_tags_skipped'
     """
-    mp3_isrc = tags.get('isrc', [''])[0] if isinstance(tags.get('isrc'), list) else tags.get('isrc', '')
+    mp3_isrc = _get_mp3_isrc(tags)
     print(f"MP3 ISRC: '{mp3_isrc}'")
     
     if not options['fix_tags']:
         print("FIX_TAGS is false, skipping tag update.", file=sys.stderr)
         return 'fix_tags_skipped'
     
-    # Try to find matching ISRC in Deezer results
-    for idx, track_id in enumerate(track_ids, 1):
-        info = get_deezer_track_info(track_id)
-        if not info:
-            continue
-        
-        # Extract album artist
-        album_artist = info.get('album', {}).get('artist', {}).get('name') if info.get('album', {}).get('artist') else None
-        if not album_artist:
-            album_artist = info.get('artist', {}).get('name')
-        
-        # Build tags dictionary
-        deezer_tags = {
-            'album': info.get('album', {}).get('title'),
-            'title': info.get('title'),
-            'artist': info.get('artist', {}).get('name'),
-            'albumartist': album_artist,
-            'discnumber': str(info.get('disk_number')),
-            'tracknumber': str(info.get('track_position')),
-            'isrc': info.get('isrc'),
-            'genre': info.get('genre'),
-            'date': info.get('release_date'),
-            'gain': str(info.get('gain')) if info.get('gain') is not None else None,
-        }
-        
-        deezer_isrc = deezer_tags.get('isrc', '')
-        print(f"Result {idx}/{len(track_ids)} - Deezer ISRC: '{deezer_isrc}'")
-        
-        # Check for ISRC match
-        if mp3_isrc and deezer_isrc and mp3_isrc == deezer_isrc:
-            print(f"ISRC match found on result {idx}!")
-            
-            # Update basic tags
-            for k in ['album', 'title', 'albumartist', 'discnumber', 'tracknumber', 'genre', 'date', 'gain']:
-                val = deezer_tags.get(k)
-                if val is not None:
-                    set_mp3_tag(file_path, k, val)
-            
-            # Update contributors as artist
-            contributors = [c['name'] for c in info.get('contributors', [])]
-            if contributors:
-                set_mp3_tag(file_path, 'artist', ', '.join(contributors))
-            
-            # Fetch lyrics if enabled and not already present
-            if options['fetch_lyrics']:
-                from mutagen.id3 import ID3
-                id3 = ID3(file_path)
-                has_unsynced = any(frame.FrameID == 'USLT' or frame.FrameID == 'UNSYNCEDLYRICS' for frame in id3.values())
-                if has_unsynced:
-                    print("UNSYNCEDLYRICS already present in MP3, skipping lyrics fetch.", file=sys.stderr)
-                else:
-                    from .mp3_tags import get_mp3_tags
-                    merged_tags, *_ = get_mp3_tags(file_path)
-                    existing_lyrics = merged_tags.get('lyrics', [''])[0] if isinstance(merged_tags.get('lyrics'), list) else merged_tags.get('lyrics', '')
-                    if existing_lyrics:
-                        print("Lyrics already present in MP3, skipping download.", file=sys.stderr)
-                    else:
-                        duration = get_audio_duration(file_path)
-                        lyrics = search_lrclib_lyrics(
-                            deezer_tags.get('artist', artist),
-                            deezer_tags.get('title', title),
-                            deezer_tags.get('album', album),
-                            duration
-                        )
-                        if lyrics:
-                            set_mp3_tag(file_path, 'lyrics', lyrics)
-                            print("Lyrics added to MP3 file", file=sys.stderr)
-                        else:
-                            print("No lyrics found on lrclib.net for this track", file=sys.stderr)
-            else:
-                print("Lyrics fetching disabled (FETCH_LYRICS=false)", file=sys.stderr)
-            
-            print("Tags updated from Deezer (identical ISRC)\n")
-            handle_stats(stats, 'isrc_match')
-            return 'isrc_match'
+    from contextlib import closing
+    from .deezer_api import iter_deezer_track_infos
+    
+    # Try to find matching ISRC in Deezer results (fetched a few at a time,
+    # the remaining ones are not requested after the first match). A conclusive
+    # ranking looks up the top hit alone, the others only if it does not match
+    batches = [track_ids[:1], track_ids[1:]] if conclusive else [track_ids]
+    idx = 0
+    for batch in batches:
+        with closing(iter_deezer_track_infos(batch)) as candidates:
+            for track_id, info in candidates:
+                idx += 1
+                if not info:
+                    continue
+                
+                deezer_isrc = info.get('isrc') or ''
+                print(f"Result {idx}/{len(track_ids)} - Deezer ISRC: '{deezer_isrc}'")
+                
+                # Check for ISRC match
+                if mp3_isrc and deezer_isrc and mp3_isrc == deezer_isrc:
+                    print(f"ISRC match found on result {idx}!")
+                    if not _apply_deezer_track(options, info, artist, album, title, mp3):
+                        return _tag_write_failed(stats)
+                    print("Tags updated from Deezer (identical ISRC)\n")
+                    handle_stats(stats, 'isrc_match')
+                    return 'isrc_match'
     
     # No matching ISRC found
     if not mp3_isrc:
@@ -265,3 +395,146 @@ def _update_tags_from_deezer(options, tags, artist, album, title, file_path, tra
         print(f"No matching ISRC found in {len(track_ids)} Deezer results, tags not updated\n")
         handle_stats(stats, 'no_matching_isrc')
         return 'no_matching_isrc'
+
+
+def _get_mp3_isrc(tags):
+    """Return the ISRC stored in the MP3 tags, or an empty string."""
+    isrc = tags.get('isrc', [''])[0] if isinstance(tags.get('isrc'), list) else tags.get('isrc', '')
+    return (isrc or '').strip()
+
+
+def _update_tags_from_isrc(options, mp3_isrc, artist, album, title, mp3, stats):
+    """Update MP3 tags from Deezer's direct ISRC lookup.
+    
+    Args:
+        options: Processing options dictionary
+        mp3_isrc: ISRC read from the MP3 file
+        artist: Artist name
+        album: Album name
+        title: Track title
+        mp3: Parsed MP3 file (Mp3File)
+        stats: Statistics dictionary
+        
+    Returns:
+        'isrc_match' if Deezer knows the ISRC and tags were updated,
+        'tag_write_failed' if they could not be saved, None if Deezer does not
+        know the ISRC
+    """
+    from .deezer_api import get_deezer_track_by_isrc
+    print(f"MP3 ISRC: '{mp3_isrc}'")
+    info = get_deezer_track_by_isrc(mp3_isrc)
+    if not info or (info.get('isrc') or '').upper() != mp3_isrc.upper():
+        print("No direct ISRC hit on Deezer, falling back to search", file=sys.stderr)
+        return None
+    print("ISRC match found with direct lookup!")
+    if not _apply_deezer_track(options, info, artist, album, title, mp3):
+        return _tag_write_failed(stats)
+    print("Tags updated from Deezer (identical ISRC)\n")
+    handle_stats(stats, 'isrc_match')
+    return 'isrc_match'
+
+
+def _update_tags_from_album(options, tags, artist, album, title, mp3, stats):
+    """Update MP3 tags from the Deezer album of the file's folder.
+    
+    Args:
+        options: Processing options dictionary
+        tags: Current MP3 tags
+        artist: Artist name
+        album: Album name
+        title: Track title
+        mp3: Parsed MP3 file (Mp3File)
+        stats: Statistics dictionary
+        
+    Returns:
+        'album_match' if a track of the album matched and tags were updated,
+        'tag_write_failed' if they could not be saved, None if no track matched
+    """
+    from .album_match import find_album_track
+    info = find_album_track(mp3.file_path, tags, artist, album, title, mp3.duration)
+    if not info:
+        return None
+    print(f"Album match found: track {info.get('disk_number')}-{info.get('track_position')}")
+    if not _apply_deezer_track(options, info, artist, album, title, mp3):
+        return _tag_write_failed(stats)
+    print("Tags updated from Deezer album\n")
+    handle_stats(stats, 'album_match')
+    return 'album_match'
+
+
+def _tag_write_failed(stats):
+    """Report a matched track whose tags could not be saved."""
+    print("Tags could not be written, file not marked as processed\n")
+    handle_stats(stats, 'tag_write_failed')
+    return 'tag_write_failed'
+
+
+def _apply_deezer_track(options, info, artist, album, title, mp3):
+    """Write the tags of a matched Deezer track and optionally fetch lyrics.
+    
+    Args:
+        options: Processing options dictionary
+        info: Deezer track info dictionary
+        artist: Artist name from the MP3 file
+        album: Album name from the MP3 file
+        title: Track title from the MP3 file
+        mp3: Parsed MP3 file (Mp3File)
+        
+    Returns:
+        True if the tags were saved, False otherwise
+    """
+    # Extract album artist
+    album_artist = info.get('album', {}).get('artist', {}).get('name') if info.get('album', {}).get('artist') else None
+    if not album_artist:
+        album_artist = info.get('artist', {}).get('name')
+    
+    # Build tags dictionary
+    deezer_tags = {
+        'album': info.get('album', {}).get('title'),
+        'title': info.get('title'),
+        'artist': info.get('artist', {}).get('name'),
+        'albumartist': album_artist,
+        'discnumber': str(info.get('disk_number')),
+        'tracknumber': str(info.get('track_position')),
+        'isrc': info.get('isrc'),
+        'genre': info.get('genre'),
+        'date': info.get('release_date'),
+        'gain': str(info.get('gain')) if info.get('gain') is not None else None,
+    }
+    
+    # Fetch lyrics if enabled and not already present, before the tag
+    # session is opened so no file state is held during the request
+    lyrics = None
+    if options['fetch_lyrics']:
+        if mp3.id3.getall('USLT'):
+            print("UNSYNCEDLYRICS already present in MP3, skipping lyrics fetch.", file=sys.stderr)
+        else:
+            from .lyrics import search_lrclib_lyrics
+            lyrics = search_lrclib_lyrics(
+                deezer_tags.get('artist', artist),
+                deezer_tags.get('title', title),
+                deezer_tags.get('album', album),
+                mp3.duration
+            )
+            if not lyrics:
+                print("No lyrics found on lrclib.net for this track", file=sys.stderr)
+    else:
+        print("Lyrics fetching disabled (FETCH_LYRICS=false)", file=sys.stderr)
+    
+    # All changes (tags and lyrics) are written with a single save
+    with mp3.session() as session:
+        # Update basic tags
+        for k in ['album', 'title', 'albumartist', 'discnumber', 'tracknumber', 'genre', 'date', 'gain']:
+            val = deezer_tags.get(k)
+            if val is not None:
+                session.set(k, val)
+        
+        # Update contributors as artist
+        contributors = [c['name'] for c in info.get('contributors', [])]
+        if contributors:
+            session.set('artist', ', '.join(contributors))
+        
+        if lyrics:
+            session.set('lyrics', lyrics)
+            print("Lyrics added to MP3 file", file=sys.stderr)
+    return not session.failed
@@ -0,0 +1,152 @@
+"""
+Persistent cache for API responses.
+Stores JSON payloads in a SQLite file next to the processing database, with a
+TTL per entry (shorter for negative results) and a size cap enforced by
+evicting the least recently used entries.
+
+One WAL-mode connection per process is shared by all threads. Cache hits
+record their access time in memory; the times are written in one batched
+update before the size cap is checked (and on close), so eviction follows
+the exact access order without a write per hit.
+"""
+
+import sys
+import json
+import time
+import atexit
+import sqlite3
+import threading
+from .config import CACHE_DB_PATH
+
+# Writes between two size-cap checks (counting rows scans the whole table)
+EVICTION_CHECK_INTERVAL = 200
+# Hits whose access time is kept in memory before it is written anyway
+ACCESS_FLUSH_SIZE = 1000
+
+_conn = None
+_lock = threading.Lock()
+_writes_since_check = 0
+# {key: time of the last hit} not yet written to last_access
+_pending_access = {}
+_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+
+def _connect():
+    """Return the process connection, opening it on first use (call with _lock held)."""
+    global _conn
+    if _conn is None:
+        conn = sqlite3.connect(CACHE_DB_PATH, timeout=10, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        c = conn.cursor()
+        c.execute('''CREATE TABLE IF NOT EXISTS response_cache (
+            key TEXT PRIMARY KEY,
+            value TEXT,
+            negative INTEGER DEFAULT 0,
+            expires_at REAL,
+            last_access REAL
+        )''')
+        c.execute('CREATE INDEX IF NOT EXISTS response_cache_last_access ON response_cache (last_access)')
+        conn.commit()
+        _conn = conn
+        atexit.register(close_cache)
+    return _conn
+
+
+def close_cache():
+    """Close the cache connection."""
+    global _conn
+    with _lock:
+        if _conn is not None:
+            _flush_access(_conn.cursor())
+            _conn.commit()
+            _conn.close()
+            _conn = None
+
+
+def cache_get(key):
+    """Return a cached value if present and not expired.
+
+    Args:
+        key: Cache key
+
+    Returns:
+        Tuple (hit, value); value is None for cached negative results
+    """
+    now = time.time()
+    with _lock:
+        conn = _connect()
+        c = conn.cursor()
+        c.execute('SELECT value, expires_at FROM response_cache WHERE key=?', (key,))
+        row = c.fetchone()
+        if row is None or row[1] < now:
+            if row is not None:
+                c.execute('DELETE FROM response_cache WHERE key=?', (key,))
+                conn.commit()
+            _stats['misses'] += 1
+            return False, None
+        _pending_access[key] = now
+        if len(_pending_access) >= ACCESS_FLUSH_SIZE:
+            _flush_access(c)
+            conn.commit()
+        _stats['hits'] += 1
+    return True, json.loads(row[0]) if row[0] is not None else None
+
+
+def cache_set(key, value, ttl, max_entries=0):
+    """Store a JSON-serializable value.
+
+    Args:
+        key: Cache key
+        value: Value to store (None records a negative result)
+        ttl: Lifetime in seconds (0 or less stores nothing)
+        max_entries: Size cap enforced by LRU eviction (0 disables the cap)
+    """
+    global _writes_since_check
+    if ttl <= 0:
+        return
+    now = time.time()
+    payload = json.dumps(value) if value is not None else None
+    with _lock:
+        conn = _connect()
+        c = conn.cursor()
+        c.execute('''INSERT OR REPLACE INTO response_cache (key, value, negative, expires_at, last_access)
+                     VALUES (?, ?, ?, ?, ?)''',
+                  (key, payload, int(value is None), now + ttl, now))
+        _writes_since_check += 1
+        if max_entries > 0 and _writes_since_check >= EVICTION_CHECK_INTERVAL:
+            _writes_since_check = 0
+            _evict(c, max_entries, now)
+        conn.commit()
+
+
+def _flush_access(cursor):
+    """Write the access times of the hits recorded in memory (call with _lock held)."""
+    if not _pending_access:
+        return
+    # An entry replaced since its hit keeps the newer time of its write
+    cursor.executemany('UPDATE response_cache SET last_access=MAX(last_access, ?) WHERE key=?',
+                       [(accessed, key) for key, accessed in _pending_access.items()])
+    _pending_access.clear()
+
+
+def _evict(cursor, max_entries, now):
+    """Drop expired entries, then the least recently used ones above the cap (call with _lock held)."""
+    _flush_access(cursor)
+    cursor.execute('DELETE FROM response_cache WHERE expires_at < ?', (now,))
+    evicted = cursor.rowcount
+    cursor.execute('SELECT COUNT(*) FROM response_cache')
+    excess = cursor.fetchone()[0] - max_entries
+    if excess > 0:
+        cursor.execute('''DELETE FROM response_cache WHERE key IN (
+                          SELECT key FROM response_cache ORDER BY last_access LIMIT ?)''', (excess,))
+        evicted += cursor.rowcount
+    if evicted:
+        print(f"[Cache] Evicted {evicted} response cache entries", file=sys.stderr)
+        _stats['evictions'] += evicted
+
+
+def get_cache_stats():
+    """Return hit/miss/eviction counters since startup."""
+    with _lock:
+        return dict(_stats)
@@ -0,0 +1,143 @@
+"""
+Library-wide Essentia re-tag from stored activation vectors.
+Applies the current genre/mood thresholds to every analyzed track at once and
+rewrites only the genre and mood tags that actually change.
+"""
+
+import sys
+import time
+import argparse
+import numpy as np
+from . import essentia_analysis
+from .database import init_db, get_essentia_file_activations
+from .mp3_tags import TagSession
+
+
+def load_activation_matrices():
+    """Load every stored track's activations into two matrices.
+
+    Returns:
+        Tuple of (file paths, genre matrix, mood matrix)
+    """
+    rows = get_essentia_file_activations(essentia_analysis.MODEL_ID)
+    paths = [row[0] for row in rows]
+    if not rows:
+        return paths, np.zeros((0, 0), dtype=np.float32), np.zeros((0, 0), dtype=np.float32)
+    genre_matrix = np.frombuffer(b''.join(row[1] for row in rows), dtype=np.float32).reshape(len(rows), -1)
+    mood_matrix = np.frombuffer(b''.join(row[2] for row in rows), dtype=np.float32).reshape(len(rows), -1)
+    return paths, genre_matrix, mood_matrix
+
+
+def compute_tag_strings(genre_matrix, mood_matrix):
+    """Apply thresholds and top-N selection to whole matrices.
+
+    Args:
+        genre_matrix: (tracks x genre labels) mean activations
+        mood_matrix: (tracks x mood labels) mean activations
+
+    Returns:
+        Tuple of (genre strings, lists of Essentia moods), one entry per track
+    """
+    genre_labels, mood_labels = essentia_analysis.get_essentia_labels()
+    formatted_genres = np.array([essentia_analysis.format_genre_tag(label, style=essentia_analysis.GENRE_FORMAT)
+                                 for label in genre_labels], dtype=object)
+    formatted_moods = np.array([essentia_analysis.format_mood_tag(label) for label in mood_labels], dtype=object)
+
+    genre_indices, genre_keep = essentia_analysis.select_top_labels(
+        genre_matrix, essentia_analysis.TOP_N_GENRES, essentia_analysis.GENRE_THRESHOLD, fallback_to_best=True)
+    mood_indices, mood_keep = essentia_analysis.select_top_labels(
+        mood_matrix, essentia_analysis.TOP_N_MOODS, essentia_analysis.MOOD_THRESHOLD)
+
+    genre_names = formatted_genres[genre_indices]
+    mood_names = formatted_moods[mood_indices]
+    genres = ["; ".join(names[keep]) for names, keep in zip(genre_names, genre_keep)]
+    moods = [list(names[keep]) for names, keep in zip(mood_names, mood_keep)]
+    return genres, moods
+
+
+def retag_file(file_path, genre, essentia_moods, vocabulary, dry_run=False):
+    """Rewrite a file's genre/mood tags if they differ from the new selection.
+
+    Moods that did not come from Essentia are kept.
+
+    Args:
+        file_path: Path to the MP3 file
+        genre: New genre tag string
+        essentia_moods: New Essentia moods
+        vocabulary: Set of every mood Essentia can produce
+        dry_run: Only report what would change
+
+    Returns:
+        Number of tags written (0 to 2)
+    """
+    # Both tags are written with a single save, nothing is saved in dry-run mode
+    writes = 0
+    with TagSession(file_path) as session:
+        if session.failed:
+            return 0
+        current_genre = "; ".join(session.get('genre'))
+        current_moods = essentia_analysis.split_moods(session.get('mood'))
+        kept_moods = [m for m in current_moods if m not in vocabulary]
+        seen = set()
+        new_moods = [m for m in kept_moods + essentia_moods if not (m in seen or seen.add(m))]
+
+        if genre and genre != current_genre:
+            print(f"{file_path}: genre '{current_genre}' -> '{genre}'", file=sys.stderr)
+            if not dry_run:
+                session.set('genre', genre)
+            writes += 1
+        if new_moods != current_moods:
+            print(f"{file_path}: mood '{'; '.join(current_moods)}' -> '{'; '.join(new_moods)}'", file=sys.stderr)
+            if not dry_run:
+                session.set('mood', "; ".join(new_moods))
+            writes += 1
+    return 0 if session.failed else writes
+
+
+def main(argv=None):
+    """Re-tag every analyzed file from stored activations."""
+    parser = argparse.ArgumentParser(description="Re-tag genre/mood from stored Essentia activations.")
+    parser.add_argument('--genre-threshold', type=float, default=essentia_analysis.GENRE_THRESHOLD)
+    parser.add_argument('--mood-threshold', type=float, default=essentia_analysis.MOOD_THRESHOLD)
+    parser.add_argument('--top-n-genres', type=int, default=essentia_analysis.TOP_N_GENRES)
+    parser.add_argument('--top-n-moods', type=int, default=essentia_analysis.TOP_N_MOODS)
+    parser.add_argument('--genre-format', default=essentia_analysis.GENRE_FORMAT,
+                        choices=['parent_child', 'child_parent', 'child_only', 'raw'])
+    parser.add_argument('--dry-run', action='store_true', help="Report changes without writing tags")
+    args = parser.parse_args(argv)
+
+    essentia_analysis.GENRE_THRESHOLD = args.genre_threshold
+    essentia_analysis.MOOD_THRESHOLD = args.mood_threshold
+    essentia_analysis.TOP_N_GENRES = args.top_n_genres
+    essentia_analysis.TOP_N_MOODS = args.top_n_moods
+    essentia_analysis.GENRE_FORMAT = args.genre_format
+
+    init_db()
+    start = time.monotonic()
+    paths, genre_matrix, mood_matrix = load_activation_matrices()
+    if not paths:
+        print("No stored Essentia activations, nothing to re-tag.", file=sys.stderr)
+        return
+    genres, moods = compute_tag_strings(genre_matrix, mood_matrix)
+    print(f"Selected tags for {len(paths)} tracks in {time.monotonic() - start:.2f}s", file=sys.stderr)
+
+    vocabulary = essentia_analysis.essentia_mood_vocabulary()
+    changed_files = 0
+    written_tags = 0
+    for file_path, genre, file_moods in zip(paths, genres, moods):
+        try:
+            writes = retag_file(file_path, genre, file_moods, vocabulary, args.dry_run)
+        except Exception as e:
+            print(f"Error re-tagging {file_path}: {e}", file=sys.stderr)
+            continue
+        if writes:
+            changed_files += 1
+            written_tags += writes
+
+    action = "would change" if args.dry_run else "changed"
+    print(f"Re-tag done in {time.monotonic() - start:.2f}s: {changed_files}/{len(paths)} files {action} "
+          f"({written_tags} tags)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
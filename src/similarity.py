@@ -0,0 +1,263 @@
+"""
+Track similarity index over stored discogs-effnet embeddings.
+Keeps L2-normalized embeddings in a memory-mapped float16 matrix with an
+id → path index and answers "tracks similar to X" with brute-force cosine
+similarity, optionally restricted to the closest coarse clusters.
+"""
+
+import os
+import sys
+import json
+import numpy as np
+from .config import SIMILARITY_DIR
+from .database import iter_essentia_file_embeddings
+
+EMBEDDINGS_FILE = 'embeddings.npy'
+PATHS_FILE = 'paths.json'
+CENTROIDS_FILE = 'centroids.npy'
+OFFSETS_FILE = 'offsets.npy'
+
+# Rows scored per matrix product, keeps query memory bounded
+QUERY_CHUNK_ROWS = 65536
+# Rows used to train the coarse clusters
+KMEANS_SAMPLE_ROWS = 20000
+KMEANS_ITERATIONS = 10
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _train_centroids(matrix, clusters, seed=0):
+    """Spherical k-means on a sample of the (normalized) rows."""
+    rng = np.random.default_rng(seed)
+    sample_rows = rng.choice(len(matrix), size=min(len(matrix), KMEANS_SAMPLE_ROWS), replace=False)
+    sample = np.asarray(matrix[np.sort(sample_rows)], dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), size=clusters, replace=False)]
+    for _ in range(KMEANS_ITERATIONS):
+        assignments = np.argmax(sample @ centroids.T, axis=1)
+        for cluster in range(clusters):
+            members = sample[assignments == cluster]
+            if len(members):
+                centroids[cluster] = members.sum(axis=0)
+        centroids = _normalize(centroids)
+    return centroids
+
+
+def _assign(matrix, centroids):
+    assignments = np.empty(len(matrix), dtype=np.int32)
+    for start in range(0, len(matrix), QUERY_CHUNK_ROWS):
+        chunk = np.asarray(matrix[start:start + QUERY_CHUNK_ROWS], dtype=np.float32)
+        assignments[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return assignments
+
+
+def build_similarity_index(clusters=None, index_dir=SIMILARITY_DIR):
+    """Rebuild the index from the embeddings stored by the Essentia analysis.
+
+    Args:
+        clusters: Number of coarse clusters (None picks ~sqrt(tracks), 0 disables)
+        index_dir: Directory holding the index files
+
+    Returns:
+        Number of indexed tracks
+    """
+    from .essentia_analysis import MODEL_ID
+    os.makedirs(index_dir, exist_ok=True)
+    paths = []
+    vectors = []
+    for file_path, blob in iter_essentia_file_embeddings(MODEL_ID):
+        paths.append(file_path)
+        vectors.append(_normalize(np.frombuffer(blob, dtype=np.float32)).astype(np.float16))
+    if not paths:
+        print("No stored embeddings, similarity index not built.", file=sys.stderr)
+        return 0
+    matrix = np.stack(vectors)
+    del vectors
+
+    if clusters is None:
+        clusters = int(np.sqrt(len(paths))) if len(paths) >= 10000 else 0
+    clusters = min(clusters, len(paths))
+    centroids = None
+    offsets = None
+    if clusters > 1:
+        centroids = _train_centroids(matrix, clusters)
+        assignments = _assign(matrix, centroids)
+        # Store rows grouped by cluster so each cluster is one contiguous slice
+        order = np.argsort(assignments, kind='stable')
+        matrix = matrix[order]
+        paths = [paths[i] for i in order]
+        offsets = np.searchsorted(assignments[order], np.arange(clusters + 1)).astype(np.int64)
+
+    def _write(name, array):
+        # Write next to the target and swap, so readers never see a partial file
+        target = os.path.join(index_dir, name)
+        if array is None:
+            if os.path.exists(target):
+                os.remove(target)
+            return
+        tmp_path = os.path.join(index_dir, f".{name}.tmp")
+        with open(tmp_path, 'wb') as f:
+            np.save(f, array)
+        os.replace(tmp_path, target)
+
+    _write(EMBEDDINGS_FILE, matrix)
+    _write(CENTROIDS_FILE, centroids)
+    _write(OFFSETS_FILE, offsets)
+    tmp_path = os.path.join(index_dir, f".{PATHS_FILE}.tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(paths, f)
+    os.replace(tmp_path, os.path.join(index_dir, PATHS_FILE))
+    print(f"Similarity index built: {len(paths)} tracks, {clusters if clusters > 1 else 'no'} clusters",
+          file=sys.stderr)
+    return len(paths)
+
+
+class SimilarityIndex:
+    """Read-only, memory-mapped view of the similarity index."""
+
+    def __init__(self, index_dir=SIMILARITY_DIR):
+        """Open the index files.
+
+        Args:
+            index_dir: Directory holding the index files
+        """
+        self.matrix = np.load(os.path.join(index_dir, EMBEDDINGS_FILE), mmap_mode='r')
+        with open(os.path.join(index_dir, PATHS_FILE)) as f:
+            self.paths = json.load(f)
+        self.ids = {path: idx for idx, path in enumerate(self.paths)}
+        self.centroids = None
+        self.offsets = None
+        centroids_path = os.path.join(index_dir, CENTROIDS_FILE)
+        if os.path.exists(centroids_path):
+            self.centroids = np.load(centroids_path)
+            self.offsets = np.load(os.path.join(index_dir, OFFSETS_FILE))
+
+    def _candidate_ranges(self, vector, probes):
+        if self.centroids is None or not probes:
+            return [(0, len(self.paths))]
+        clusters = np.argsort(-(self.centroids @ vector))[:probes]
+        return [(int(self.offsets[c]), int(self.offsets[c + 1])) for c in clusters]
+
+    def query_vector(self, vector, k=10, probes=None, exclude=None):
+        """Return the k most similar tracks to an embedding.
+
+        Args:
+            vector: Embedding (any norm)
+            k: Number of results
+            probes: Number of closest clusters to scan (None or 0 scans all rows)
+            exclude: Row id to leave out of the results
+
+        Returns:
+            List of (path, cosine similarity) tuples, best first
+        """
+        vector = _normalize(np.asarray(vector, dtype=np.float32))
+        best_rows = np.zeros(0, dtype=np.int64)
+        best_scores = np.zeros(0, dtype=np.float32)
+        for range_start, range_end in self._candidate_ranges(vector, probes):
+            for start in range(range_start, range_end, QUERY_CHUNK_ROWS):
+                end = min(start + QUERY_CHUNK_ROWS, range_end)
+                scores = np.asarray(self.matrix[start:end], dtype=np.float32) @ vector
+                rows = np.arange(start, end)
+                if exclude is not None and start <= exclude < end:
+                    scores[exclude - start] = -np.inf
+                best_rows = np.concatenate([best_rows, rows])
+                best_scores = np.concatenate([best_scores, scores])
+                if len(best_scores) > k:
+                    top = np.argpartition(-best_scores, k)[:k]
+                    best_rows, best_scores = best_rows[top], best_scores[top]
+        order = np.argsort(-best_scores)
+        return [(self.paths[best_rows[i]], float(best_scores[i])) for i in order if np.isfinite(best_scores[i])]
+
+    def query_path(self, file_path, k=10, probes=None):
+        """Return the k tracks most similar to an indexed file.
+
+        Args:
+            file_path: Path of an indexed MP3 file
+            k: Number of results
+            probes: Number of closest clusters to scan (None or 0 scans all rows)
+
+        Returns:
+            List of (path, cosine similarity) tuples, best first
+
+        Raises:
+            KeyError: If the file is not in the index
+        """
+        row = self.ids[file_path]
+        return self.query_vector(self.matrix[row], k, probes, exclude=row)
+
+
+def serve_similarity_api(index, host='127.0.0.1', port=8765):
+    """Serve GET /similar?path=<file>&k=10[&probes=N] as JSON over HTTP."""
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    from urllib.parse import urlparse, parse_qs
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = parse_qs(url.query)
+            if url.path != '/similar' or 'path' not in params:
+                return self._reply(404, {'error': 'use /similar?path=<file>&k=10'})
+            try:
+                k = int(params.get('k', ['10'])[0])
+                probes = int(params['probes'][0]) if 'probes' in params else None
+                results = index.query_path(params['path'][0], k, probes)
+            except KeyError:
+                return self._reply(404, {'error': 'track not in similarity index'})
+            except ValueError as e:
+                return self._reply(400, {'error': str(e)})
+            self._reply(200, [{'path': path, 'score': score} for path, score in results])
+
+        def _reply(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            print(f"[Similarity] {self.address_string()} {format % args}", file=sys.stderr)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    print(f"Similarity API listening on http://{host}:{port}/similar", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+def main(argv=None):
+    """Command line entry point: build, query or serve the similarity index."""
+    import argparse
+    parser = argparse.ArgumentParser(description="Track similarity over stored Essentia embeddings.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    build = sub.add_parser('build', help="Rebuild the index from the database")
+    build.add_argument('--clusters', type=int, default=None, help="Coarse clusters (default ~sqrt(tracks), 0 disables)")
+    query = sub.add_parser('query', help="List tracks similar to a file")
+    query.add_argument('path')
+    query.add_argument('-k', type=int, default=10)
+    query.add_argument('--probes', type=int, default=None, help="Closest clusters to scan (default all)")
+    serve = sub.add_parser('serve', help="Serve the index over a small local HTTP API")
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        build_similarity_index(args.clusters)
+    elif args.command == 'query':
+        try:
+            results = SimilarityIndex().query_path(args.path, args.k, args.probes)
+        except KeyError:
+            print(f"Track not in similarity index: {args.path}", file=sys.stderr)
+            sys.exit(1)
+        for path, score in results:
+            print(f"{score:.4f}\t{path}")
+    elif args.command == 'serve':
+        serve_similarity_api(SimilarityIndex(), args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()